@@ -2,9 +2,10 @@
 Configuración de Base de Datos - SQLite con soporte para PostgreSQL
 """
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, insert, select, update, bindparam, text
 from sqlalchemy.orm import sessionmaker
-from .models import Base
+from .models import Base, AccessToken
+from .utils.security import token_digest
 
 # Configuración desde variables de entorno
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/cybergap.db")
@@ -33,6 +34,90 @@ def init_db():
     # Asegurar que el directorio data existe
     os.makedirs("data", exist_ok=True)
     Base.metadata.create_all(bind=engine)
+    _migrate_schema()
+    _backfill_token_hashes()
+
+
+def _migrate_schema():
+    """
+    Agregar a tablas existentes las columnas (e índices) nuevos del modelo
+    
+    create_all solo crea tablas faltantes; esto cubre columnas agregadas
+    después de creada la base, sin necesidad de una herramienta de migraciones.
+    """
+    inspector = inspect(engine)
+    
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            added = [column for column in table.columns if column.name not in existing]
+            
+            for column in added:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if isinstance(default, (bool, int, float)):
+                    ddl += f" DEFAULT {int(default) if isinstance(default, bool) else default}"
+                conn.execute(text(ddl))
+            
+            added_names = {column.name for column in added}
+            for index in table.indexes:
+                if added_names.intersection(column.name for column in index.columns):
+                    index.create(conn)
+
+
+def _backfill_token_hashes(batch_size: int = 1000):
+    """
+    Completar token_hash de los tokens creados antes de existir la columna
+    
+    Las búsquedas públicas usan el hash; el índice sobre el token en claro
+    queda obsoleto y se elimina.
+    """
+    table = AccessToken.__table__
+    
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        if any(index["name"] == "ix_access_tokens_token" for index in inspector.get_indexes(table.name)):
+            conn.execute(text("DROP INDEX ix_access_tokens_token"))
+    
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("_id"))
+        .values(token_hash=bindparam("_hash"))
+    )
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.token)
+                .where(table.c.token_hash.is_(None), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                return
+            conn.execute(stmt, [{"_id": row.id, "_hash": token_digest(row.token)} for row in rows])
+            last_id = rows[-1].id
+
+
+def insert_ignoring_conflicts(model, index_elements):
+    """
+    INSERT masivo que omite las filas que violan una restricción única
+    
+    Args:
+        model: Modelo (o tabla) destino
+        index_elements: Columnas de la restricción única a respetar
+    """
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(model).prefix_with("IGNORE")
+    return dialect_insert(model).on_conflict_do_nothing(index_elements=index_elements)
 
 
 def get_db():
@@ -13,6 +13,9 @@ from fastapi.exceptions import RequestValidationError
 from .database import engine, Base, init_db, get_db
 from .models import AdminUser
 from .utils.security import hash_password
+from .services.jobs import job_queue
+from .services.outbox import outbox_worker
+from .services.reminders import reminder_scheduler
 from .routers import (
     auth_router,
     companies_router,
@@ -32,10 +35,16 @@ async def lifespan(app: FastAPI):
     print("🚀 Iniciando CyberGAP...")
     init_db()
     await create_default_admin()
+    job_queue.start()
+    outbox_worker.start()
+    reminder_scheduler.start()
     print("✅ CyberGAP listo!")
     yield
     # Shutdown
     print("👋 Cerrando CyberGAP...")
+    await reminder_scheduler.stop()
+    await outbox_worker.stop()
+    job_queue.shutdown()
 
 
 async def create_default_admin():
@@ -104,6 +113,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],
 )
 
 
@@ -204,22 +214,36 @@ async def export_company_report(
     db: Session = Depends(get_db),
     admin: AdminUser = Depends(get_current_admin)
 ):
-    """Exportar reporte a Excel"""
-    from fastapi.responses import FileResponse
+    """Exportar reporte a Excel (descarga en streaming)"""
+    from fastapi import HTTPException
+    from fastapi.responses import StreamingResponse
+    from starlette.concurrency import run_in_threadpool
+    from .models import Company
+    from .services.reports import iter_file_chunks
     import tempfile
     
+    if not db.query(Company.id).filter(Company.id == company_id).first():
+        raise HTTPException(status_code=404, detail="Empresa no encontrada")
+    
     service = ReportService(db)
     
     # Crear archivo temporal
     with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
         filepath = tmp.name
     
-    service.export_to_excel(company_id, filepath, questionnaire_id)
+    try:
+        await run_in_threadpool(service.export_to_excel, company_id, filepath, questionnaire_id)
+    except Exception:
+        os.remove(filepath)
+        raise
     
-    return FileResponse(
-        path=filepath,
-        filename=f"reporte_cybergap_{company_id}.xlsx",
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    return StreamingResponse(
+        iter_file_chunks(filepath),
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={
+            "Content-Disposition": f'attachment; filename="reporte_cybergap_{company_id}.xlsx"',
+            "Content-Length": str(os.path.getsize(filepath))
+        }
     )
 
 
@@ -241,6 +265,28 @@ async def get_divergences(
 app.include_router(reports_router, prefix="/api")
 
 
+# Jobs Router (trabajos en segundo plano)
+from fastapi import HTTPException
+from .schemas import JobResponse
+
+jobs_router = APIRouter(prefix="/jobs", tags=["Trabajos"])
+
+
+@jobs_router.get("/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: str,
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """Consultar estado de un trabajo en segundo plano"""
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job.to_dict()
+
+
+app.include_router(jobs_router, prefix="/api")
+
+
 # SMTP Config Router
 from .models import SMTPConfig
 from .schemas import SMTPConfigCreate, SMTPConfigUpdate, SMTPConfigResponse
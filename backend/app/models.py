@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import Optional, List
 from sqlalchemy import (
     Column, Integer, String, Text, Boolean, DateTime, Float,
-    ForeignKey, Enum as SQLEnum, JSON, UniqueConstraint, Table
+    ForeignKey, Enum as SQLEnum, JSON, UniqueConstraint, Table, Index, LargeBinary
 )
 from sqlalchemy.orm import relationship, declarative_base
 import enum
@@ -37,6 +37,12 @@ class AlertSeverity(str, enum.Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+class OutboxStatus(str, enum.Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
 # ============================================================================
 # MODELOS PRINCIPALES
 # ============================================================================
@@ -220,6 +226,12 @@ class QuestionAssignment(Base):
 # TOKENS DE ACCESO Y RESPUESTAS
 # ============================================================================
 
+def _token_hash_default(context):
+    """Calcular token_hash a partir del token al insertar"""
+    from .utils.security import token_digest  # Import diferido: utils importa los modelos
+    return token_digest(context.get_current_parameters()["token"])
+
+
 class AccessToken(Base):
     """Token único de acceso para cada usuario/cuestionario"""
     __tablename__ = "access_tokens"
@@ -227,7 +239,8 @@ class AccessToken(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     questionnaire_id = Column(Integer, ForeignKey("questionnaire_assignments.id", ondelete="CASCADE"), nullable=False)
-    token = Column(String(64), unique=True, nullable=False, index=True)
+    token = Column(String(64), nullable=False)  # Se conserva para reenviar el enlace
+    token_hash = Column(LargeBinary(32), unique=True, nullable=False, index=True, default=_token_hash_default)
     status = Column(SQLEnum(TokenStatus), default=TokenStatus.PENDING)
     sent_at = Column(DateTime, nullable=True)
     opened_at = Column(DateTime, nullable=True)
@@ -235,11 +248,17 @@ class AccessToken(Base):
     expires_at = Column(DateTime, nullable=True)
     ip_address = Column(String(45), nullable=True)
     user_agent = Column(String(500), nullable=True)
+    send_attempts = Column(Integer, default=0)  # Intentos de envío del correo
+    last_send_attempt_at = Column(DateTime, nullable=True)
+    last_send_error = Column(String(500), nullable=True)  # Último error de envío (None si se envió)
+    next_reminder_at = Column(DateTime, nullable=True)  # Próximo recordatorio (None = ninguno programado)
+    reminders_sent = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Índice único
     __table_args__ = (
         UniqueConstraint('user_id', 'questionnaire_id', name='uq_token_user_questionnaire'),
+        Index('ix_token_status_next_reminder', 'status', 'next_reminder_at'),
     )
     
     # Relaciones
@@ -286,6 +305,32 @@ class DivergenceAlert(Base):
     question = relationship("Question")
 
 
+class QuestionResponseStats(Base):
+    """Estadísticas acumuladas (Welford) de las respuestas a una pregunta en un cuestionario"""
+    __tablename__ = "question_response_stats"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    questionnaire_id = Column(Integer, ForeignKey("questionnaire_assignments.id", ondelete="CASCADE"), nullable=False)
+    question_id = Column(Integer, ForeignKey("questions.id", ondelete="CASCADE"), nullable=False)
+    response_count = Column(Integer, default=0, nullable=False)
+    # Respuestas numéricas (preguntas de escala)
+    value_count = Column(Integer, default=0, nullable=False)
+    value_mean = Column(Float, default=0.0, nullable=False)
+    value_m2 = Column(Float, default=0.0, nullable=False)
+    # Puntajes calculados
+    score_count = Column(Integer, default=0, nullable=False)
+    score_mean = Column(Float, default=0.0, nullable=False)
+    score_m2 = Column(Float, default=0.0, nullable=False)
+    min_score = Column(Float, nullable=True)
+    max_score = Column(Float, nullable=True)
+    answer_counts = Column(JSON, nullable=True)  # Histograma {respuesta_normalizada: cantidad}
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint('questionnaire_id', 'question_id', name='uq_stats_questionnaire_question'),
+    )
+
+
 # ============================================================================
 # CONFIGURACIÓN SMTP POR EMPRESA
 # ============================================================================
@@ -315,6 +360,33 @@ class SMTPConfig(Base):
     company = relationship("Company", back_populates="smtp_config")
 
 
+class EmailOutbox(Base):
+    """
+    Bandeja de salida de correos
+    Cada fila es un correo por enviar; el mensaje se arma al enviarlo a partir
+    del token de acceso (tipo de plantilla + token)
+    """
+    __tablename__ = "email_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id", ondelete="CASCADE"), nullable=False)
+    access_token_id = Column(Integer, ForeignKey("access_tokens.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String(20), nullable=False, default="questionnaire")  # questionnaire, reminder
+    to_email = Column(String(255), nullable=False)
+    status = Column(SQLEnum(OutboxStatus), default=OutboxStatus.PENDING, nullable=False)
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(500), nullable=True)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    claimed_at = Column(DateTime, nullable=True)  # Cuándo un worker lo reservó (estado SENDING)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    
+    # Índice para tomar los pendientes vencidos
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+
 # ============================================================================
 # CONFIGURACIÓN GLOBAL DEL SISTEMA
 # ============================================================================
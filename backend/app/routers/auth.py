@@ -1,33 +1,126 @@
 """
 Router de Autenticación
 """
+import os
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Deque, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
 from ..database import get_db
 from ..models import AdminUser
 from ..schemas import Token, LoginRequest, AdminUserCreate, AdminUserResponse, AdminUserUpdate
-from ..utils.security import verify_password, get_password_hash, create_access_token, decode_token
+from ..utils.cache import TTLCache
+from ..utils.security import (
+    verify_password_async, get_password_hash_async, create_access_token, decode_token
+)
 
 router = APIRouter(prefix="/auth", tags=["Autenticación"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token")
 
+# Tokens ya verificados -> (id, email) del admin (evita decodificar el JWT en cada request)
+ADMIN_AUTH_CACHE_TTL = float(os.getenv("ADMIN_AUTH_CACHE_TTL", "60"))
+_admin_cache = TTLCache(ttl=ADMIN_AUTH_CACHE_TTL, maxsize=1024)
+
+
+# Límite de intentos fallidos de login por IP y email (ventana deslizante)
+LOGIN_RATE_LIMIT = int(os.getenv("LOGIN_RATE_LIMIT", "10"))
+LOGIN_RATE_WINDOW = float(os.getenv("LOGIN_RATE_WINDOW", "300"))  # segundos
+
+
+class LoginRateLimiter:
+    """Cuenta los intentos fallidos recientes por clave (IP y email) y bloquea al superar el límite"""
+    
+    def __init__(self, limit: int, window: float, maxsize: int = 10000):
+        self.limit = limit
+        self.window = window
+        self.maxsize = maxsize
+        self._failures: "OrderedDict[str, Deque[float]]" = OrderedDict()
+    
+    def retry_after(self, key: str) -> Optional[int]:
+        """Segundos a esperar si la clave está bloqueada (None si puede intentar)"""
+        failures = self._failures.get(key)
+        if not failures:
+            return None
+        now = time.monotonic()
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        if len(failures) < self.limit:
+            return None
+        return max(1, int(failures[0] + self.window - now) + 1)
+    
+    def record_failure(self, key: str) -> None:
+        failures = self._failures.pop(key, None) or deque()
+        failures.append(time.monotonic())
+        self._failures[key] = failures
+        while len(self._failures) > self.maxsize:
+            self._failures.popitem(last=False)
+    
+    def reset(self, key: str) -> None:
+        """Olvidar los fallos de la clave (tras un login exitoso)"""
+        self._failures.pop(key, None)
+
+
+login_rate_limiter = LoginRateLimiter(LOGIN_RATE_LIMIT, LOGIN_RATE_WINDOW)
+
+
+def _check_login_rate(request: Request, email: str) -> str:
+    """
+    Rechazar con 429 si la IP superó el límite de intentos para el email
+    
+    La IP es la del cliente según X-Forwarded-For (uvicorn con --proxy-headers
+    detrás de nginx); por clave, un usuario bloqueado no bloquea a los demás
+    que comparten la IP.
+    
+    Returns:
+        str: Clave (IP, email) para registrar el resultado
+    """
+    client_ip = request.client.host if request.client else "unknown"
+    key = f"{client_ip}|{email.strip().lower()}"
+    retry_after = login_rate_limiter.retry_after(key)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos de inicio de sesión, intenta más tarde",
+            headers={"Retry-After": str(retry_after)},
+        )
+    return key
+
 
 async def get_current_admin(
     token: str = Depends(oauth2_scheme),
     db: Session = Depends(get_db)
 ) -> AdminUser:
-    """Obtener admin actual desde token"""
+    """
+    Obtener admin actual desde token
+    
+    Para los tokens ya verificados la caché (hasta ADMIN_AUTH_CACHE_TTL
+    segundos, nunca más allá de su exp) guarda solo el id y el email del
+    admin: se evita decodificar el JWT, pero el admin se lee siempre de la BD,
+    así una desactivación, eliminación o cambio de email rige de inmediato.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    cached = _admin_cache.get(token)
+    if cached is not None:
+        admin_id, email = cached
+        admin = db.get(AdminUser, admin_id)
+        if admin is None or not admin.is_active or admin.email != email:
+            _admin_cache.pop(token)
+            raise credentials_exception
+        return admin
+    
     payload = decode_token(token)
     if payload is None:
         raise credentials_exception
@@ -40,6 +133,12 @@ async def get_current_admin(
     if admin is None or not admin.is_active:
         raise credentials_exception
     
+    ttl = ADMIN_AUTH_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        _admin_cache.set(token, (admin.id, admin.email), ttl=ttl)
+    
     return admin
 
 
@@ -57,13 +156,16 @@ async def get_current_superadmin(
 
 @router.post("/token", response_model=Token)
 async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
     """Endpoint OAuth2 para login"""
+    client_key = _check_login_rate(request, form_data.username)
     admin = db.query(AdminUser).filter(AdminUser.email == form_data.username).first()
     
-    if not admin or not verify_password(form_data.password, admin.hashed_password):
+    if not admin or not await verify_password_async(form_data.password, admin.hashed_password):
+        login_rate_limiter.record_failure(client_key)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
@@ -76,6 +178,8 @@ async def login(
             detail="Usuario desactivado"
         )
     
+    login_rate_limiter.reset(client_key)
+    
     # Actualizar último login
     admin.last_login = datetime.utcnow()
     db.commit()
@@ -87,13 +191,16 @@ async def login(
 
 @router.post("/login", response_model=Token)
 async def login_json(
+    request: Request,
     login_data: LoginRequest,
     db: Session = Depends(get_db)
 ):
     """Login con JSON body"""
+    client_key = _check_login_rate(request, login_data.email)
     admin = db.query(AdminUser).filter(AdminUser.email == login_data.email).first()
     
-    if not admin or not verify_password(login_data.password, admin.hashed_password):
+    if not admin or not await verify_password_async(login_data.password, admin.hashed_password):
+        login_rate_limiter.record_failure(client_key)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos"
@@ -105,6 +212,7 @@ async def login_json(
             detail="Usuario desactivado"
         )
     
+    login_rate_limiter.reset(client_key)
     admin.last_login = datetime.utcnow()
     db.commit()
     
@@ -137,7 +245,7 @@ async def create_admin(
     admin = AdminUser(
         email=admin_data.email,
         full_name=admin_data.full_name,
-        hashed_password=get_password_hash(admin_data.password),
+        hashed_password=await get_password_hash_async(admin_data.password),
         is_superadmin=admin_data.is_superadmin
     )
     db.add(admin)
@@ -162,7 +270,7 @@ async def update_admin(
     update_data = admin_data.model_dump(exclude_unset=True)
     
     if "password" in update_data:
-        update_data["hashed_password"] = get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await get_password_hash_async(update_data.pop("password"))
     
     for key, value in update_data.items():
         setattr(admin, key, value)
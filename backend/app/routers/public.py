@@ -5,6 +5,8 @@ Este endpoint NO requiere autenticación de admin
 from typing import List, Optional
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from ..database import get_db
@@ -13,10 +15,12 @@ from ..models import (
     User, Area, Company, QuestionnaireAssignment, Response
 )
 from ..schemas import (
-    PublicQuestionnaire, PublicQuestionnaireInfo, PublicQuestion,
-    ResponseSubmit, QuestionOption
+    PublicQuestionnaire, PublicQuestionnaireInfo, ResponseSubmit
 )
-from ..services.divergence import DivergenceService
+from ..services.divergence import DivergenceService, enqueue_divergence_recalculation
+from ..services.question_cache import question_cache
+from ..services.token_status import token_status_cache
+from ..utils.security import token_digest
 
 router = APIRouter(prefix="/public", tags=["Público"])
 
@@ -31,15 +35,32 @@ async def get_survey(
     Obtener cuestionario público por token
     Valida el token y devuelve las preguntas asignadas al usuario
     """
-    # Buscar token
-    access_token = db.query(AccessToken).filter(AccessToken.token == token).first()
+    digest = token_digest(token)
     
-    if not access_token:
+    # Buscar token junto con usuario, cuestionario y empresa (una sola consulta)
+    row = db.query(
+        AccessToken,
+        User.full_name.label("user_name"),
+        QuestionnaireAssignment.name.label("questionnaire_name"),
+        QuestionnaireAssignment.end_date.label("deadline"),
+        Company.name.label("company_name"),
+        Company.logo_url.label("company_logo")
+    ).join(
+        User, AccessToken.user_id == User.id
+    ).join(
+        QuestionnaireAssignment, AccessToken.questionnaire_id == QuestionnaireAssignment.id
+    ).join(
+        Company, QuestionnaireAssignment.company_id == Company.id
+    ).filter(AccessToken.token_hash == digest).first()
+    
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Enlace inválido o expirado"
         )
     
+    access_token = row.AccessToken
+    
     # Verificar estado del token
     if access_token.status == TokenStatus.COMPLETED:
         raise HTTPException(
@@ -57,85 +78,70 @@ async def get_survey(
     if access_token.expires_at and access_token.expires_at < datetime.utcnow():
         access_token.status = TokenStatus.EXPIRED
         db.commit()
+        token_status_cache.invalidate([digest])
         raise HTTPException(
             status_code=status.HTTP_410_GONE,
             detail="Este enlace ha expirado"
         )
     
-    # Marcar como abierto
+    # Marcar como abierto (se confirma junto con el resto al final)
     if access_token.status in [TokenStatus.PENDING, TokenStatus.SENT]:
         access_token.status = TokenStatus.OPENED
         access_token.opened_at = datetime.utcnow()
         access_token.ip_address = request.client.host if request.client else None
         access_token.user_agent = request.headers.get("user-agent", "")[:500]
-        db.commit()
-    
-    # Obtener datos
-    user = db.query(User).filter(User.id == access_token.user_id).first()
-    questionnaire = db.query(QuestionnaireAssignment).filter(
-        QuestionnaireAssignment.id == access_token.questionnaire_id
-    ).first()
-    company = db.query(Company).filter(Company.id == questionnaire.company_id).first()
     
-    # Obtener asignaciones del usuario para este cuestionario
-    assignments = db.query(QuestionAssignment).filter(
+    # Asignaciones pendientes (sin respuesta) con la versión de sus preguntas activas
+    pending = db.query(
+        QuestionAssignment.id.label("assignment_id"),
+        QuestionAssignment.order,
+        QuestionAssignment.question_id,
+        Question.updated_at
+    ).join(
+        Question, QuestionAssignment.question_id == Question.id
+    ).outerjoin(
+        Response, Response.assignment_id == QuestionAssignment.id
+    ).filter(
         QuestionAssignment.questionnaire_id == access_token.questionnaire_id,
-        QuestionAssignment.user_id == access_token.user_id
-    ).order_by(QuestionAssignment.order).all()
+        QuestionAssignment.user_id == access_token.user_id,
+        Response.id.is_(None),
+        Question.is_active == True
+    ).order_by(QuestionAssignment.order, QuestionAssignment.id).all()
     
-    # Filtrar las que ya tienen respuesta
-    questions = []
-    for assignment in assignments:
-        # Verificar si ya tiene respuesta
-        existing_response = db.query(Response).filter(
-            Response.assignment_id == assignment.id
-        ).first()
-        
-        if existing_response:
-            continue  # Ya respondida
-        
-        question = db.query(Question).filter(Question.id == assignment.question_id).first()
-        if question and question.is_active:
-            options = None
-            if question.options:
-                options = [
-                    QuestionOption(
-                        value=opt.get("value", ""),
-                        text=opt.get("text", ""),
-                        score=opt.get("score", 0)
-                    )
-                    for opt in question.options
-                ]
-            
-            questions.append(PublicQuestion(
-                assignment_id=assignment.id,
-                question_id=question.id,
-                text=question.text,
-                description=question.description,
-                question_type=question.question_type,
-                options=options,
-                required=question.required,
-                order=assignment.order
-            ))
+    # Preguntas precompiladas (solo se cargan las que no están en caché o cambiaron)
+    cached = question_cache.get_many(
+        db, {item.question_id: item.updated_at for item in pending}
+    )
+    
+    questions = [
+        cached[item.question_id].render(item.assignment_id, item.order)
+        for item in pending
+        if item.question_id in cached
+    ]
     
     # Si no hay preguntas pendientes, marcar como completado
     if not questions:
         access_token.status = TokenStatus.COMPLETED
         access_token.completed_at = datetime.utcnow()
         db.commit()
+        token_status_cache.invalidate([digest])
         raise HTTPException(
             status_code=status.HTTP_410_GONE,
             detail="Ya has completado todas las preguntas de este cuestionario"
         )
     
+    if access_token in db.dirty:
+        db.commit()
+        token_status_cache.invalidate([digest])
+    
     return PublicQuestionnaire(
         info=PublicQuestionnaireInfo(
-            questionnaire_name=questionnaire.name,
-            company_name=company.name,
-            company_logo=company.logo_url,
-            user_name=user.full_name,
+            questionnaire_name=row.questionnaire_name,
+            company_name=row.company_name,
+            company_logo=row.company_logo,
+            user_name=row.user_name,
             total_questions=len(questions),
-            deadline=questionnaire.end_date
+            deadline=row.deadline
         ),
         questions=questions
     )
@@ -153,7 +159,8 @@ async def submit_survey(
     Este endpoint marca el token como usado después de un envío exitoso
     """
     # Validar token
-    access_token = db.query(AccessToken).filter(AccessToken.token == token).first()
+    digest = token_digest(token)
+    access_token = db.query(AccessToken).filter(AccessToken.token_hash == digest).first()
     
     if not access_token:
         raise HTTPException(
@@ -177,14 +184,41 @@ async def submit_survey(
     if access_token.expires_at and access_token.expires_at < datetime.utcnow():
         access_token.status = TokenStatus.EXPIRED
         db.commit()
+        token_status_cache.invalidate([digest])
         raise HTTPException(
             status_code=status.HTTP_410_GONE,
             detail="Este enlace ha expirado"
         )
     
+    # Precargar asignaciones del token con su respuesta (si existe) y la versión de su pregunta
+    assignments = {
+        row.id: row
+        for row in db.query(
+            QuestionAssignment.id,
+            QuestionAssignment.question_id,
+            Response.id.label("response_id"),
+            Question.updated_at
+        ).outerjoin(
+            Response, Response.assignment_id == QuestionAssignment.id
+        ).outerjoin(
+            Question, QuestionAssignment.question_id == Question.id
+        ).filter(
+            QuestionAssignment.questionnaire_id == access_token.questionnaire_id,
+            QuestionAssignment.user_id == access_token.user_id
+        )
+    }
+    answered = {assignment_id for assignment_id, row in assignments.items() if row.response_id}
+    
+    # Preguntas precompiladas (con su calculador de puntaje)
+    cached = question_cache.get_many(
+        db, {row.question_id: row.updated_at for row in assignments.values()}
+    )
+    
     # Procesar respuestas
     saved_count = 0
     errors = []
+    rows = []
+    stats_items = []
     
     for resp_data in data.responses:
         assignment_id = resp_data.get("assignment_id")
@@ -192,60 +226,68 @@ async def submit_survey(
         time_spent = resp_data.get("time_spent_seconds", 0)
         
         # Verificar que la asignación pertenece al usuario y cuestionario
-        assignment = db.query(QuestionAssignment).filter(
-            QuestionAssignment.id == assignment_id,
-            QuestionAssignment.questionnaire_id == access_token.questionnaire_id,
-            QuestionAssignment.user_id == access_token.user_id
-        ).first()
+        assignment = assignments.get(assignment_id)
         
         if not assignment:
             errors.append(f"Asignación {assignment_id} no válida")
             continue
         
-        # Verificar si ya existe respuesta
-        existing = db.query(Response).filter(Response.assignment_id == assignment_id).first()
-        if existing:
+        # Verificar si ya existe respuesta (o viene repetida en este envío)
+        if assignment_id in answered:
             errors.append(f"Pregunta {assignment_id} ya respondida")
             continue
         
         # Calcular score
-        question = db.query(Question).filter(Question.id == assignment.question_id).first()
-        score = calculate_score(question, answer)
+        question = cached.get(assignment.question_id)
+        score = question.scorer(answer) if question else 0
         
-        # Guardar respuesta
-        response = Response(
-            assignment_id=assignment_id,
-            answer=answer,
-            score=score,
-            time_spent_seconds=time_spent
-        )
-        db.add(response)
+        rows.append({
+            "assignment_id": assignment_id,
+            "answer": answer,
+            "score": score,
+            "time_spent_seconds": time_spent
+        })
+        stats_items.append({
+            "assignment_id": assignment_id,
+            "question_id": assignment.question_id,
+            "question_type": question.scorer.question_type if question else None,
+            "answer": answer,
+            "score": score
+        })
+        answered.add(assignment_id)
         saved_count += 1
     
-    # Verificar si quedan preguntas pendientes
-    total_assignments = db.query(QuestionAssignment).filter(
-        QuestionAssignment.questionnaire_id == access_token.questionnaire_id,
-        QuestionAssignment.user_id == access_token.user_id
-    ).count()
-    
-    total_responses = db.query(Response).join(QuestionAssignment).filter(
-        QuestionAssignment.questionnaire_id == access_token.questionnaire_id,
-        QuestionAssignment.user_id == access_token.user_id
-    ).count() + saved_count
+    # Guardar respuestas en un solo INSERT
+    if rows:
+        try:
+            db.execute(insert(Response), rows)
+        except IntegrityError:
+            # Otro envío con el mismo token guardó alguna de estas respuestas primero
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Algunas respuestas ya fueron registradas, recarga el cuestionario"
+            )
     
     # Si todas las preguntas están respondidas, marcar token como completado
-    if total_responses >= total_assignments:
+    if len(answered) >= len(assignments):
         access_token.status = TokenStatus.COMPLETED
         access_token.completed_at = datetime.utcnow()
-        
-        # Recalcular divergencias en background
-        try:
-            service = DivergenceService(db)
-            service.calculate_divergences(access_token.questionnaire_id)
-        except Exception as e:
-            pass  # No fallar si hay error calculando divergencias
+    
+    # Acumular estadísticas por pregunta en la misma transacción que las respuestas
+    service = DivergenceService(db)
+    service.record_responses(access_token.questionnaire_id, stats_items)
     
     db.commit()
+    token_status_cache.invalidate([digest])
+    
+    # Recalcular en segundo plano solo las preguntas respondidas en este envío
+    if stats_items:
+        enqueue_divergence_recalculation(
+            access_token.questionnaire_id,
+            {item["question_id"] for item in stats_items},
+            [item["assignment_id"] for item in stats_items]
+        )
     
     return {
         "success": True,
@@ -256,63 +298,15 @@ async def submit_survey(
     }
 
 
-def calculate_score(question: Question, answer) -> float:
-    """Calcular puntaje basado en la respuesta"""
-    if not question or answer is None:
-        return 0
-    
-    if question.question_type.value == "yes_no":
-        # Asumimos que "yes" es la respuesta correcta/deseada
-        return question.max_score if str(answer).lower() in ["yes", "sí", "si", "true", "1"] else 0
-    
-    elif question.question_type.value == "single_choice":
-        if question.options:
-            for opt in question.options:
-                if str(opt.get("value")) == str(answer):
-                    return opt.get("score", 0)
-        return 0
-    
-    elif question.question_type.value == "multiple_choice":
-        total_score = 0
-        if question.options and isinstance(answer, list):
-            for opt in question.options:
-                if opt.get("value") in answer:
-                    total_score += opt.get("score", 0)
-        return total_score
-    
-    elif question.question_type.value == "scale":
-        # Para escala, el score es proporcional al valor
-        try:
-            value = float(answer)
-            # Asumiendo escala 1-5 o 1-10
-            max_scale = 10 if question.max_score > 50 else 5
-            return (value / max_scale) * question.max_score
-        except (ValueError, TypeError):
-            return 0
-    
-    elif question.question_type.value == "text":
-        # Para texto, asignar score completo si hay respuesta
-        return question.max_score if answer and str(answer).strip() else 0
-    
-    return 0
-
-
 @router.get("/survey/{token}/status", response_model=dict)
 async def get_survey_status(
     token: str,
     db: Session = Depends(get_db)
 ):
-    """Obtener estado del cuestionario"""
-    access_token = db.query(AccessToken).filter(AccessToken.token == token).first()
+    """Obtener estado del cuestionario (servido desde caché en memoria)"""
+    snapshot = token_status_cache.get(db, token_digest(token))
     
-    if not access_token:
+    if snapshot is None:
         return {"valid": False, "status": "invalid"}
     
-    return {
-        "valid": True,
-        "status": access_token.status.value,
-        "sent_at": access_token.sent_at.isoformat() if access_token.sent_at else None,
-        "opened_at": access_token.opened_at.isoformat() if access_token.opened_at else None,
-        "completed_at": access_token.completed_at.isoformat() if access_token.completed_at else None,
-        "expires_at": access_token.expires_at.isoformat() if access_token.expires_at else None
-    }
+    return {"valid": True, **snapshot}
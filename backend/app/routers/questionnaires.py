@@ -3,65 +3,75 @@ Router de Cuestionarios y Asignaciones
 """
 from typing import List, Optional
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, status, Query, BackgroundTasks, Response as HTTPResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from ..database import get_db
+from ..database import get_db, insert_ignoring_conflicts
 from ..models import (
     QuestionnaireAssignment, QuestionAssignment, Question, User, Area, 
-    Company, AccessToken, TokenStatus, Response, AdminUser, SMTPConfig
+    Company, AccessToken, TokenStatus, Response, AdminUser,
+    DivergenceAlert, EmailOutbox, OutboxStatus
 )
 from ..schemas import (
     QuestionnaireAssignmentCreate, QuestionnaireAssignmentUpdate, 
     QuestionnaireAssignmentResponse, QuestionnaireWithStats,
     QuestionAssignmentCreate, QuestionAssignmentBulkCreate, 
     QuestionAssignmentResponse, QuestionAssignmentWithDetails,
-    SendTokensRequest, AccessTokenResponse
+    SendTokensRequest, AccessTokenResponse, JobResponse
 )
-from ..utils.security import generate_unique_token
-from ..utils.email import EmailService, get_questionnaire_email_template
-from ..services.divergence import DivergenceService
+from ..utils.security import generate_unique_token, token_digest
+from ..services.outbox import enqueue_emails, outbox_worker
+from ..services.divergence import enqueue_divergence_recalculation
+from ..services.reminders import schedule_missing_reminders
 from .auth import get_current_admin
 
 router = APIRouter(prefix="/questionnaires", tags=["Cuestionarios"])
 
 
-@router.get("", response_model=List[QuestionnaireWithStats])
-async def list_questionnaires(
-    company_id: Optional[int] = None,
-    is_active: Optional[bool] = None,
-    skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
-    admin: AdminUser = Depends(get_current_admin)
-):
-    """Listar cuestionarios con estadísticas"""
-    query = db.query(QuestionnaireAssignment)
-    
-    if company_id:
-        query = query.filter(QuestionnaireAssignment.company_id == company_id)
-    
-    if is_active is not None:
-        query = query.filter(QuestionnaireAssignment.is_active == is_active)
+def _questionnaires_with_stats(db: Session, rows) -> List[QuestionnaireWithStats]:
+    """
+    Armar QuestionnaireWithStats para una página de cuestionarios
+    
+    Las estadísticas de todos los cuestionarios de la página se obtienen con
+    dos consultas agrupadas por questionnaire_id (asignaciones/respuestas y
+    alertas no resueltas), sin consultas por fila.
+    
+    Args:
+        rows: Tuplas (QuestionnaireAssignment, nombre de empresa)
+    """
+    questionnaire_ids = [q.id for q, _ in rows]
+    if not questionnaire_ids:
+        return []
+    
+    assignment_stats = {
+        row.questionnaire_id: row
+        for row in db.query(
+            QuestionAssignment.questionnaire_id,
+            func.count(QuestionAssignment.id).label("total_assignments"),
+            func.count(Response.id).label("completed_assignments")
+        ).outerjoin(
+            Response, Response.assignment_id == QuestionAssignment.id
+        ).filter(
+            QuestionAssignment.questionnaire_id.in_(questionnaire_ids)
+        ).group_by(QuestionAssignment.questionnaire_id)
+    }
     
-    questionnaires = query.order_by(QuestionnaireAssignment.created_at.desc()).offset(skip).limit(limit).all()
+    divergence_counts = dict(
+        db.query(
+            DivergenceAlert.questionnaire_id,
+            func.count(DivergenceAlert.id)
+        ).filter(
+            DivergenceAlert.questionnaire_id.in_(questionnaire_ids),
+            DivergenceAlert.is_resolved == False
+        ).group_by(DivergenceAlert.questionnaire_id).all()
+    )
     
     result = []
-    for q in questionnaires:
-        company = db.query(Company).filter(Company.id == q.company_id).first()
-        
-        total_assignments = db.query(QuestionAssignment).filter(
-            QuestionAssignment.questionnaire_id == q.id
-        ).count()
-        
-        completed_assignments = db.query(QuestionAssignment).join(Response).filter(
-            QuestionAssignment.questionnaire_id == q.id
-        ).count()
-        
-        divergence_count = db.query(func.count()).filter(
-            QuestionnaireAssignment.id == q.id
-        ).scalar() or 0
+    for q, company_name in rows:
+        stats = assignment_stats.get(q.id)
+        total_assignments = stats.total_assignments if stats else 0
+        completed_assignments = stats.completed_assignments if stats else 0
         
         completion_rate = (completed_assignments / total_assignments * 100) if total_assignments > 0 else 0
         
@@ -77,16 +87,41 @@ async def list_questionnaires(
             reminder_days=q.reminder_days,
             created_at=q.created_at,
             updated_at=q.updated_at,
-            company_name=company.name if company else "",
+            company_name=company_name or "",
             total_assignments=total_assignments,
             completed_assignments=completed_assignments,
             completion_rate=round(completion_rate, 2),
-            divergence_alerts_count=divergence_count
+            divergence_alerts_count=divergence_counts.get(q.id, 0)
         ))
     
     return result
 
 
+@router.get("", response_model=List[QuestionnaireWithStats])
+async def list_questionnaires(
+    company_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """Listar cuestionarios con estadísticas"""
+    query = db.query(QuestionnaireAssignment, Company.name).outerjoin(
+        Company, QuestionnaireAssignment.company_id == Company.id
+    )
+    
+    if company_id:
+        query = query.filter(QuestionnaireAssignment.company_id == company_id)
+    
+    if is_active is not None:
+        query = query.filter(QuestionnaireAssignment.is_active == is_active)
+    
+    rows = query.order_by(QuestionnaireAssignment.created_at.desc()).offset(skip).limit(limit).all()
+    
+    return _questionnaires_with_stats(db, rows)
+
+
 @router.post("", response_model=QuestionnaireAssignmentResponse, status_code=status.HTTP_201_CREATED)
 async def create_questionnaire(
     data: QuestionnaireAssignmentCreate,
@@ -114,40 +149,13 @@ async def get_questionnaire(
     admin: AdminUser = Depends(get_current_admin)
 ):
     """Obtener cuestionario por ID"""
-    q = db.query(QuestionnaireAssignment).filter(QuestionnaireAssignment.id == questionnaire_id).first()
-    if not q:
+    row = db.query(QuestionnaireAssignment, Company.name).outerjoin(
+        Company, QuestionnaireAssignment.company_id == Company.id
+    ).filter(QuestionnaireAssignment.id == questionnaire_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
     
-    company = db.query(Company).filter(Company.id == q.company_id).first()
-    
-    total_assignments = db.query(QuestionAssignment).filter(
-        QuestionAssignment.questionnaire_id == q.id
-    ).count()
-    
-    completed_assignments = db.query(QuestionAssignment).join(Response).filter(
-        QuestionAssignment.questionnaire_id == q.id
-    ).count()
-    
-    completion_rate = (completed_assignments / total_assignments * 100) if total_assignments > 0 else 0
-    
-    return QuestionnaireWithStats(
-        id=q.id,
-        company_id=q.company_id,
-        name=q.name,
-        description=q.description,
-        start_date=q.start_date,
-        end_date=q.end_date,
-        is_active=q.is_active,
-        send_reminders=q.send_reminders,
-        reminder_days=q.reminder_days,
-        created_at=q.created_at,
-        updated_at=q.updated_at,
-        company_name=company.name if company else "",
-        total_assignments=total_assignments,
-        completed_assignments=completed_assignments,
-        completion_rate=round(completion_rate, 2),
-        divergence_alerts_count=0
-    )
+    return _questionnaires_with_stats(db, [row])[0]
 
 
 @router.put("/{questionnaire_id}", response_model=QuestionnaireAssignmentResponse)
@@ -168,6 +176,11 @@ async def update_questionnaire(
     for key, value in update_data.items():
         setattr(questionnaire, key, value)
     
+    # Al activar (o cambiar) los recordatorios, programar los tokens ya enviados
+    if questionnaire.send_reminders and {"send_reminders", "reminder_days"} & update_data.keys():
+        db.flush()
+        schedule_missing_reminders(db, questionnaire.id)
+    
     db.commit()
     db.refresh(questionnaire)
     
@@ -198,28 +211,62 @@ async def delete_questionnaire(
 @router.get("/{questionnaire_id}/assignments", response_model=List[QuestionAssignmentWithDetails])
 async def list_assignments(
     questionnaire_id: int,
+    response: HTTPResponse,
     user_id: Optional[int] = None,
+    area_id: Optional[int] = None,
+    is_answered: Optional[bool] = None,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
     db: Session = Depends(get_db),
     admin: AdminUser = Depends(get_current_admin)
 ):
-    """Listar asignaciones de un cuestionario"""
-    query = db.query(QuestionAssignment).filter(
+    """
+    Listar asignaciones de un cuestionario (una sola consulta con joins)
+    Paginado opcional con skip/limit (sin limit se devuelven todas); el total
+    se informa en la cabecera X-Total-Count
+    """
+    query = db.query(
+        QuestionAssignment,
+        Question.text.label("question_text"),
+        Question.question_type,
+        User.full_name.label("user_name"),
+        User.email.label("user_email"),
+        Area.name.label("area_name"),
+        Response.id.label("response_id")
+    ).join(
+        Question, QuestionAssignment.question_id == Question.id
+    ).join(
+        User, QuestionAssignment.user_id == User.id
+    ).join(
+        Area, User.area_id == Area.id
+    ).outerjoin(
+        Response, Response.assignment_id == QuestionAssignment.id
+    ).filter(
         QuestionAssignment.questionnaire_id == questionnaire_id
     )
     
     if user_id:
         query = query.filter(QuestionAssignment.user_id == user_id)
     
-    assignments = query.order_by(QuestionAssignment.order).all()
+    if area_id:
+        query = query.filter(User.area_id == area_id)
     
-    result = []
-    for a in assignments:
-        question = db.query(Question).filter(Question.id == a.question_id).first()
-        user = db.query(User).filter(User.id == a.user_id).first()
-        area = db.query(Area).filter(Area.id == user.area_id).first() if user else None
-        response = db.query(Response).filter(Response.assignment_id == a.id).first()
-        
-        result.append(QuestionAssignmentWithDetails(
+    if is_answered is not None:
+        query = query.filter(Response.id.isnot(None) if is_answered else Response.id.is_(None))
+    
+    rows = query.order_by(
+        QuestionAssignment.order, QuestionAssignment.id
+    ).offset(skip).limit(limit).all()
+    
+    # Solo se cuenta si la página no basta para deducir el total
+    if (limit is None or len(rows) < limit) and (rows or not skip):
+        total = skip + len(rows)
+    else:
+        total = query.count()
+    response.headers["X-Total-Count"] = str(total)
+    
+    return [
+        QuestionAssignmentWithDetails(
             id=a.id,
             questionnaire_id=a.questionnaire_id,
             question_id=a.question_id,
@@ -227,15 +274,15 @@ async def list_assignments(
             order=a.order,
             is_mandatory=a.is_mandatory,
             created_at=a.created_at,
-            question_text=question.text if question else "",
-            question_type=question.question_type if question else "text",
-            user_name=user.full_name if user else "",
-            user_email=user.email if user else "",
-            area_name=area.name if area else "",
-            is_answered=response is not None
-        ))
-    
-    return result
+            question_text=question_text,
+            question_type=question_type,
+            user_name=user_name,
+            user_email=user_email,
+            area_name=area_name,
+            is_answered=response_id is not None
+        )
+        for a, question_text, question_type, user_name, user_email, area_name, response_id in rows
+    ]
 
 
 @router.post("/{questionnaire_id}/assignments", response_model=QuestionAssignmentResponse, status_code=status.HTTP_201_CREATED)
@@ -376,23 +423,16 @@ async def send_tokens(
     db: Session = Depends(get_db),
     admin: AdminUser = Depends(get_current_admin)
 ):
-    """Generar y enviar tokens a usuarios"""
+    """
+    Generar tokens y encolar sus correos
+    El envío lo hace en segundo plano el worker de la bandeja de salida
+    """
     questionnaire = db.query(QuestionnaireAssignment).filter(
         QuestionnaireAssignment.id == questionnaire_id
     ).first()
     if not questionnaire:
         raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
     
-    company = db.query(Company).filter(Company.id == questionnaire.company_id).first()
-    
-    # Obtener configuración SMTP de la empresa o usar default
-    smtp_config = db.query(SMTPConfig).filter(
-        SMTPConfig.company_id == questionnaire.company_id,
-        SMTPConfig.is_active == True
-    ).first()
-    
-    email_service = EmailService(smtp_config)
-    
     # Obtener usuarios a enviar
     if data.user_ids:
         user_ids = data.user_ids
@@ -403,68 +443,89 @@ async def send_tokens(
         ).distinct().all()
         user_ids = [u[0] for u in user_ids]
     
-    sent_count = 0
-    error_count = 0
+    user_ids = list(dict.fromkeys(user_ids))
     
-    for user_id in user_ids:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user or not user.is_active:
-            continue
-        
-        # Verificar si ya tiene token activo
-        existing_token = db.query(AccessToken).filter(
-            AccessToken.user_id == user_id,
+    # Usuarios activos y tokens existentes, en dos consultas
+    emails = dict(
+        db.query(User.id, User.email).filter(
+            User.id.in_(user_ids),
+            User.is_active == True
+        ).all()
+    ) if user_ids else {}
+    
+    tokens = {
+        access_token.user_id: access_token
+        for access_token in db.query(AccessToken).filter(
             AccessToken.questionnaire_id == questionnaire_id,
-            AccessToken.status.in_([TokenStatus.PENDING, TokenStatus.SENT, TokenStatus.OPENED])
-        ).first()
-        
-        if existing_token and existing_token.status == TokenStatus.COMPLETED:
-            continue  # Ya completó
+            AccessToken.user_id.in_(list(emails))
+        )
+    } if emails else {}
+    
+    # Generar en lote los tokens faltantes (un único INSERT que respeta
+    # uq_token_user_questionnaire si otro envío los creó en paralelo)
+    missing = [user_id for user_id in user_ids if user_id in emails and user_id not in tokens]
+    if missing:
+        values = set()
+        while len(values) < len(missing):
+            values.add(generate_unique_token())
         
-        # Generar o reusar token
-        if not existing_token:
-            token_str = generate_unique_token()
-            access_token = AccessToken(
-                user_id=user_id,
-                questionnaire_id=questionnaire_id,
-                token=token_str,
-                status=TokenStatus.PENDING,
-                expires_at=questionnaire.end_date
+        db.execute(
+            insert_ignoring_conflicts(AccessToken, ["user_id", "questionnaire_id"]),
+            [
+                {
+                    "user_id": user_id,
+                    "questionnaire_id": questionnaire_id,
+                    "token": value,
+                    "token_hash": token_digest(value),
+                    "status": TokenStatus.PENDING,
+                    "expires_at": questionnaire.end_date
+                }
+                for user_id, value in zip(missing, values)
+            ]
+        )
+        tokens.update(
+            (access_token.user_id, access_token)
+            for access_token in db.query(AccessToken).filter(
+                AccessToken.questionnaire_id == questionnaire_id,
+                AccessToken.user_id.in_(missing)
             )
-            db.add(access_token)
-        else:
-            token_str = existing_token.token
-            access_token = existing_token
-        
-        # Enviar email
-        html_content, text_content = get_questionnaire_email_template(
-            user_name=user.full_name,
-            company_name=company.name,
-            questionnaire_name=questionnaire.name,
-            token=token_str,
-            deadline=questionnaire.end_date
         )
-        
-        success = email_service.send_email(
-            to_email=user.email,
-            subject=f"[{company.name}] Cuestionario de Cumplimiento - {questionnaire.name}",
-            html_content=html_content,
-            text_content=text_content
+    
+    recipients = [  # (access_token, email)
+        (tokens[user_id], emails[user_id])
+        for user_id in user_ids
+        if user_id in tokens
+        and tokens[user_id].status in (TokenStatus.PENDING, TokenStatus.SENT, TokenStatus.OPENED)
+    ]
+    
+    # No duplicar correos que todavía están en la bandeja de salida
+    queued_ids = {
+        row.access_token_id
+        for row in db.query(EmailOutbox.access_token_id).filter(
+            EmailOutbox.access_token_id.in_([access_token.id for access_token, _ in recipients]),
+            EmailOutbox.kind == "questionnaire",
+            EmailOutbox.status.in_([OutboxStatus.PENDING, OutboxStatus.SENDING])
         )
-        
-        if success:
-            access_token.status = TokenStatus.SENT
-            access_token.sent_at = datetime.utcnow()
-            sent_count += 1
-        else:
-            error_count += 1
+    } if recipients else set()
+    
+    queued = enqueue_emails(db, [
+        {
+            "company_id": questionnaire.company_id,
+            "access_token_id": access_token.id,
+            "to_email": email,
+            "kind": "questionnaire"
+        }
+        for access_token, email in recipients
+        if access_token.id not in queued_ids
+    ])
     
     db.commit()
+    outbox_worker.notify()
     
     return {
-        "sent": sent_count,
-        "errors": error_count,
-        "message": f"Se enviaron {sent_count} correos exitosamente"
+        "queued": queued,
+        "already_queued": len(queued_ids),
+        "message": f"Se encolaron {queued} correos para envío"
     }
 
 
@@ -486,24 +547,22 @@ async def list_tokens(
 # DIVERGENCIAS
 # ============================================================================
 
-@router.post("/{questionnaire_id}/calculate-divergences", response_model=dict)
+@router.post("/{questionnaire_id}/calculate-divergences", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
 async def calculate_divergences(
     questionnaire_id: int,
     db: Session = Depends(get_db),
     admin: AdminUser = Depends(get_current_admin)
 ):
-    """Calcular divergencias para un cuestionario"""
+    """
+    Encolar recálculo de divergencias para un cuestionario
+    El avance se consulta en GET /jobs/{job_id}
+    """
     questionnaire = db.query(QuestionnaireAssignment).filter(
         QuestionnaireAssignment.id == questionnaire_id
     ).first()
     if not questionnaire:
         raise HTTPException(status_code=404, detail="Cuestionario no encontrado")
     
-    service = DivergenceService(db)
-    alerts = service.calculate_divergences(questionnaire_id)
-    summary = service.get_divergence_summary(questionnaire_id)
+    job = enqueue_divergence_recalculation(questionnaire_id)
     
-    return {
-        "alerts_created": len(alerts),
-        "summary": summary
-    }
+    return job.to_dict()
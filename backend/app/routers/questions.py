@@ -10,8 +10,11 @@ from ..database import get_db
 from ..models import Question, Category, AdminUser
 from ..schemas import (
     QuestionCreate, QuestionUpdate, QuestionResponse, QuestionWithCategory,
-    CategoryCreate, CategoryUpdate, CategoryResponse, CategoryWithCount
+    CategoryCreate, CategoryUpdate, CategoryResponse, CategoryWithCount,
+    JobResponse
 )
+from ..services.question_cache import question_cache
+from ..services.rescoring import enqueue_rescore
 from .auth import get_current_admin
 
 router = APIRouter(prefix="/questions", tags=["Preguntas"])
@@ -350,10 +353,20 @@ async def update_question(
             for opt in update_data["options"]
         ]
     
+    scoring_before = _scoring_snapshot(question)
+    
     for key, value in update_data.items():
         setattr(question, key, value)
     
+    scoring_changed = _scoring_snapshot(question) != scoring_before
+    
     db.commit()
+    question_cache.invalidate([question_id])
+    
+    # Los puntajes guardados dependen de opciones, puntaje máximo y tipo
+    if scoring_changed:
+        enqueue_rescore(question_id)
+    
     db.refresh(question)
     
     return question
@@ -372,3 +385,33 @@ async def delete_question(
     
     question.is_active = False
     db.commit()
+    question_cache.invalidate([question_id])
+
+
+@router.post("/{question_id}/rescore", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def rescore_question(
+    question_id: int,
+    db: Session = Depends(get_db),
+    admin: AdminUser = Depends(get_current_admin)
+):
+    """
+    Encolar el recálculo de puntajes de las respuestas de una pregunta
+    El avance se consulta en GET /jobs/{job_id}
+    """
+    question = db.query(Question.id).filter(Question.id == question_id).first()
+    if not question:
+        raise HTTPException(status_code=404, detail="Pregunta no encontrada")
+    
+    job = enqueue_rescore(question_id)
+    
+    return job.to_dict()
+
+
+def _scoring_snapshot(question: Question) -> tuple:
+    """Valores de la pregunta que determinan el puntaje de sus respuestas"""
+    question_type = question.question_type
+    return (
+        question.options,
+        question.max_score,
+        question_type.value if question_type is not None else None
+    )
@@ -381,6 +381,9 @@ class AccessTokenResponse(BaseSchema):
     opened_at: Optional[datetime]
     completed_at: Optional[datetime]
     expires_at: Optional[datetime]
+    send_attempts: Optional[int] = 0
+    last_send_attempt_at: Optional[datetime] = None
+    last_send_error: Optional[str] = None
     created_at: datetime
 
 
@@ -524,6 +527,24 @@ class DashboardStats(BaseModel):
     completion_rate: float
 
 
+# ============================================================================
+# JOB SCHEMAS (Trabajos en segundo plano)
+# ============================================================================
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    key: Any
+    status: str
+    requests: int
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
 # ============================================================================
 # PUBLIC QUESTIONNAIRE SCHEMAS (Para formulario público)
 # ============================================================================
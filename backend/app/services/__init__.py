@@ -1,3 +1,4 @@
 """Services Package"""
 from .divergence import DivergenceService
 from .reports import ReportService
+from .jobs import JobQueue, job_queue
@@ -2,16 +2,21 @@
 Servicio de Detección de Divergencias
 Core del negocio - Detecta contradicciones en respuestas
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Set
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from collections import defaultdict
+from sqlalchemy import func, insert, update
+from collections import defaultdict, Counter
+import json
+import math
 import statistics
 
+from ..database import SessionLocal, insert_ignoring_conflicts
 from ..models import (
     QuestionAssignment, Response, Question, User, Area, 
-    DivergenceAlert, AlertSeverity, QuestionnaireAssignment
+    DivergenceAlert, AlertSeverity, QuestionnaireAssignment,
+    QuestionResponseStats
 )
+from .jobs import job_queue, Job
 
 
 class DivergenceService:
@@ -20,67 +25,395 @@ class DivergenceService:
     def __init__(self, db: Session):
         self.db = db
     
-    def calculate_divergences(self, questionnaire_id: int) -> List[DivergenceAlert]:
+    def calculate_divergences(self, questionnaire_id: int) -> Dict[str, int]:
         """
         Calcular divergencias para un cuestionario
         
         Detecta cuando la misma pregunta asignada a múltiples usuarios
-        tiene respuestas diferentes.
+        tiene respuestas diferentes. También reconstruye las estadísticas
+        acumuladas del cuestionario.
         
         Returns:
-            Lista de alertas de divergencia creadas
+            Dict con la cantidad de alertas creadas, actualizadas y sin cambios
         """
-        # Obtener todas las preguntas del cuestionario que fueron asignadas a múltiples usuarios
-        questions_with_multiple_assignments = self._get_questions_with_multiple_responses(questionnaire_id)
+        from .divergence_batch import BatchDivergenceAnalyzer
         
-        alerts = []
+        # Lectura y cálculo fuera de la transacción de escritura: en SQLite el
+        # lock de escritura bloquea los envíos de encuestas mientras dure
+        rows = self._responses_query(questionnaire_id).all()
+        last_response_id = max((row.response_id for row in rows), default=0)
+        analyses = BatchDivergenceAnalyzer(rows).analyze()
+        stats = self._build_stats(questionnaire_id, rows=rows)
+        existing_alerts = self._unresolved_alerts(
+            questionnaire_id,
+            [question_id for question_id, info in analyses.items() if info["has_divergence"]]
+        )
         
-        for question_id, responses_data in questions_with_multiple_assignments.items():
-            if len(responses_data) < 2:
-                continue
+        # Escritura en una sola transacción corta (las alertas de respuestas
+        # llegadas entretanto las actualiza el recálculo incremental de su envío)
+        self._replace_stats(questionnaire_id, stats, after_response_id=last_response_id)
+        return self._save_divergences(questionnaire_id, analyses, existing_alerts)
+    
+    def update_divergences_for_questions(
+        self,
+        questionnaire_id: int,
+        question_ids: Iterable[int],
+        assignment_ids: Optional[Iterable[int]] = None
+    ) -> Dict[str, int]:
+        """
+        Recalcular divergencias solo para las preguntas indicadas (modo incremental)
+        
+        Se usa al recibir un envío: únicamente las preguntas respondidas en
+        ese envío pueden cambiar su divergencia, por lo que no es necesario
+        re-analizar el cuestionario completo. La decisión se toma desde las
+        estadísticas acumuladas. Si la pregunta ya tiene alerta y se conocen
+        las asignaciones del envío (assignment_ids), solo se cargan esas
+        respuestas y se agregan a las de la alerta, siempre que con ellas la
+        alerta quede con tantas respuestas como las estadísticas; si no, y
+        para alertas nuevas o tipos que no pueden evaluarse desde las
+        estadísticas, se cargan las respuestas completas.
+        
+        Returns:
+            Dict con la cantidad de alertas creadas, actualizadas y sin cambios
+        """
+        question_ids = set(question_ids)
+        if not question_ids:
+            return {"created": 0, "updated": 0, "unchanged": 0}
+        
+        stats_rows = self.db.query(
+            QuestionResponseStats, Question.question_type
+        ).join(
+            Question, QuestionResponseStats.question_id == Question.id
+        ).filter(
+            QuestionResponseStats.questionnaire_id == questionnaire_id,
+            QuestionResponseStats.question_id.in_(question_ids)
+        ).all()
+        
+        analyses = {}
+        response_counts = {}
+        pending_ids = set(question_ids)
+        for stats, question_type in stats_rows:
+            response_counts[stats.question_id] = stats.response_count
+            info = self._analyze_stats(stats, question_type)
+            if info is None:
+                continue  # Tipo no soportado por las estadísticas
+            pending_ids.discard(stats.question_id)
+            if stats.response_count > 1 and info["has_divergence"]:
+                analyses[stats.question_id] = info
+        
+        existing_alerts = self._unresolved_alerts(questionnaire_id, analyses.keys() | pending_ids)
+        
+        # Alertas existentes: agregar solo las respuestas de este envío. Si la
+        # alerta no tiene todas las respuestas previas (llegaron mientras la
+        # pregunta no divergía), la pregunta se carga completa
+        appendable = set()
+        if assignment_ids is not None:
+            candidates = {question_id for question_id in analyses if question_id in existing_alerts}
+            new_responses = defaultdict(list)
+            if candidates:
+                for row in self._responses_query(questionnaire_id, candidates).filter(
+                    QuestionAssignment.id.in_(set(assignment_ids))
+                ):
+                    new_responses[row.question_id].append(_response_entry(row))
             
-            # Analizar divergencia
-            divergence_info = self._analyze_divergence(responses_data)
+            for question_id in candidates:
+                responses = list(existing_alerts[question_id].responses_data or [])
+                known_users = {response["user_id"] for response in responses}
+                responses.extend(
+                    response for response in new_responses.get(question_id, [])
+                    if response["user_id"] not in known_users
+                )
+                if len(responses) == response_counts[question_id]:
+                    analyses[question_id]["responses"] = responses
+                    appendable.add(question_id)
+        
+        to_load = pending_ids | (analyses.keys() - appendable)
+        questions_data = self._get_questions_with_multiple_responses(questionnaire_id, to_load) if to_load else {}
+        
+        for question_id in list(analyses.keys() - appendable):
+            if question_id in questions_data:
+                analyses[question_id]["responses"] = questions_data[question_id]["responses"]
+            else:
+                del analyses[question_id]
+        
+        for question_id in pending_ids:
+            if question_id in questions_data:
+                analyses[question_id] = self._analyze_divergence(questions_data[question_id])
+        
+        return self._save_divergences(questionnaire_id, analyses, existing_alerts)
+    
+    def _unresolved_alerts(self, questionnaire_id: int, question_ids: Iterable[int]) -> Dict[int, DivergenceAlert]:
+        """Alertas no resueltas de las preguntas indicadas, por question_id"""
+        question_ids = set(question_ids)
+        if not question_ids:
+            return {}
+        return {
+            alert.question_id: alert
+            for alert in self.db.query(DivergenceAlert).filter(
+                DivergenceAlert.questionnaire_id == questionnaire_id,
+                DivergenceAlert.question_id.in_(question_ids),
+                DivergenceAlert.is_resolved == False
+            )
+        }
+    
+    def _save_divergences(
+        self,
+        questionnaire_id: int,
+        analyses: Dict[int, Dict],
+        existing_alerts: Optional[Dict[int, DivergenceAlert]] = None
+    ) -> Dict[str, int]:
+        """
+        Crear/actualizar en bloque las alertas de las preguntas analizadas
+        
+        Carga las alertas no resueltas existentes en una sola consulta (salvo
+        que se reciban ya cargadas) y escribe las nuevas y modificadas con un
+        INSERT y un UPDATE masivos. Las alertas cuyos datos no cambiaron no se
+        escriben.
+        """
+        divergent = {
+            question_id: info
+            for question_id, info in analyses.items()
+            if info["has_divergence"]
+        }
+        
+        if existing_alerts is None:
+            existing_alerts = self._unresolved_alerts(questionnaire_id, divergent.keys())
+        
+        new_rows = []
+        changed_rows = []
+        unchanged = 0
+        
+        for question_id, divergence_info in divergent.items():
+            existing_alert = existing_alerts.get(question_id)
             
-            if divergence_info["has_divergence"]:
-                # Verificar si ya existe una alerta para esta pregunta
-                existing_alert = self.db.query(DivergenceAlert).filter(
-                    DivergenceAlert.questionnaire_id == questionnaire_id,
-                    DivergenceAlert.question_id == question_id,
-                    DivergenceAlert.is_resolved == False
-                ).first()
-                
-                if existing_alert:
-                    # Actualizar alerta existente
-                    existing_alert.responses_data = divergence_info["responses"]
-                    existing_alert.variance = divergence_info["variance"]
-                    existing_alert.severity = divergence_info["severity"]
-                    alerts.append(existing_alert)
-                else:
-                    # Crear nueva alerta
-                    alert = DivergenceAlert(
-                        questionnaire_id=questionnaire_id,
-                        question_id=question_id,
-                        severity=divergence_info["severity"],
-                        responses_data=divergence_info["responses"],
-                        variance=divergence_info["variance"]
-                    )
-                    self.db.add(alert)
-                    alerts.append(alert)
+            if existing_alert is None:
+                new_rows.append({
+                    "questionnaire_id": questionnaire_id,
+                    "question_id": question_id,
+                    "severity": divergence_info["severity"],
+                    "responses_data": divergence_info["responses"],
+                    "variance": divergence_info["variance"]
+                })
+            elif (
+                existing_alert.severity != divergence_info["severity"]
+                or not _same_variance(existing_alert.variance, divergence_info["variance"])
+                or existing_alert.responses_data != divergence_info["responses"]
+            ):
+                changed_rows.append({
+                    "id": existing_alert.id,
+                    "severity": divergence_info["severity"],
+                    "responses_data": divergence_info["responses"],
+                    "variance": divergence_info["variance"]
+                })
+            else:
+                unchanged += 1
+        
+        if new_rows:
+            self.db.execute(insert(DivergenceAlert), new_rows)
+        if changed_rows:
+            self.db.execute(update(DivergenceAlert), changed_rows)
         
         self.db.commit()
-        return alerts
+        return {
+            "created": len(new_rows),
+            "updated": len(changed_rows),
+            "unchanged": unchanged
+        }
     
-    def _get_questions_with_multiple_responses(self, questionnaire_id: int) -> Dict[int, List[Dict]]:
+    # ------------------------------------------------------------------
+    # Estadísticas acumuladas por pregunta
+    # ------------------------------------------------------------------
+    
+    def record_responses(self, questionnaire_id: int, items: List[Dict[str, Any]]) -> None:
         """
-        Obtener preguntas con múltiples respuestas
+        Acumular nuevas respuestas en las estadísticas por pregunta
+        
+        No hace commit: las estadísticas se guardan en la misma transacción
+        que las respuestas.
+        
+        Args:
+            items: [{assignment_id, question_id, question_type, answer, score}]
+        """
+        if not items:
+            return
+        
+        question_ids = {item["question_id"] for item in items}
+        stats_by_question = {
+            stats.question_id: stats
+            for stats in self.db.query(QuestionResponseStats).filter(
+                QuestionResponseStats.questionnaire_id == questionnaire_id,
+                QuestionResponseStats.question_id.in_(question_ids)
+            )
+        }
+        
+        missing_ids = question_ids - stats_by_question.keys()
+        if missing_ids:
+            # Inicializar con las respuestas que ya existan para esas preguntas. Si
+            # otro envío concurrente crea la misma fila primero, se usa la suya.
+            seeds = self._build_stats(
+                questionnaire_id,
+                missing_ids,
+                exclude_assignment_ids=[item["assignment_id"] for item in items]
+            )
+            self.db.execute(
+                insert_ignoring_conflicts(QuestionResponseStats, ["questionnaire_id", "question_id"]),
+                [_stats_values(stats) for stats in seeds.values()]
+            )
+            stats_by_question.update(
+                (stats.question_id, stats)
+                for stats in self.db.query(QuestionResponseStats).filter(
+                    QuestionResponseStats.questionnaire_id == questionnaire_id,
+                    QuestionResponseStats.question_id.in_(missing_ids)
+                )
+            )
+        
+        for item in items:
+            _accumulate_response(
+                stats_by_question[item["question_id"]],
+                item["question_type"],
+                item["answer"],
+                item["score"]
+            )
+    
+    def rebuild_stats(self, questionnaire_id: int) -> Dict[int, QuestionResponseStats]:
+        """Reconstruir desde cero las estadísticas acumuladas de un cuestionario"""
+        stats_by_question = self._build_stats(questionnaire_id)
+        self._replace_stats(questionnaire_id, stats_by_question)
+        return stats_by_question
+    
+    def _replace_stats(
+        self,
+        questionnaire_id: int,
+        stats_by_question: Dict[int, QuestionResponseStats],
+        after_response_id: Optional[int] = None
+    ) -> None:
+        """
+        Reemplazar las estadísticas guardadas del cuestionario (sin commit)
+        
+        Args:
+            after_response_id: Incorporar además las respuestas guardadas después
+                               de calcular stats_by_question (id mayor a éste)
+        """
+        self.db.query(QuestionResponseStats).filter(
+            QuestionResponseStats.questionnaire_id == questionnaire_id
+        ).delete(synchronize_session=False)
+        
+        if after_response_id is not None:
+            _accumulate_rows(
+                questionnaire_id,
+                stats_by_question,
+                self._stats_query(questionnaire_id).filter(Response.id > after_response_id)
+            )
+        
+        self.db.add_all(stats_by_question.values())
+    
+    def _build_stats(
+        self,
+        questionnaire_id: int,
+        question_ids: Optional[Set[int]] = None,
+        exclude_assignment_ids: Optional[List[int]] = None,
+        rows: Optional[Iterable[Any]] = None
+    ) -> Dict[int, QuestionResponseStats]:
+        """
+        Calcular estadísticas a partir de las respuestas guardadas (sin agregarlas a la sesión)
+        
+        Args:
+            rows: Respuestas ya cargadas (question_id, question_type, answer, score);
+                  si no se entregan se consultan
+        """
+        if rows is None:
+            rows = self._stats_query(questionnaire_id, question_ids, exclude_assignment_ids)
+        
+        stats_by_question = {
+            question_id: _new_stats(questionnaire_id, question_id)
+            for question_id in (question_ids or [])
+        }
+        _accumulate_rows(questionnaire_id, stats_by_question, rows)
+        return stats_by_question
+    
+    def _stats_query(
+        self,
+        questionnaire_id: int,
+        question_ids: Optional[Set[int]] = None,
+        exclude_assignment_ids: Optional[List[int]] = None
+    ):
+        """Query de respuestas con los campos que usan las estadísticas"""
+        query = self.db.query(
+            QuestionAssignment.question_id,
+            Question.question_type,
+            Response.answer,
+            Response.score
+        ).join(
+            Response, QuestionAssignment.id == Response.assignment_id
+        ).join(
+            Question, QuestionAssignment.question_id == Question.id
+        ).filter(
+            QuestionAssignment.questionnaire_id == questionnaire_id
+        )
+        
+        if question_ids is not None:
+            query = query.filter(QuestionAssignment.question_id.in_(question_ids))
+        
+        if exclude_assignment_ids:
+            query = query.filter(QuestionAssignment.id.notin_(exclude_assignment_ids))
+        
+        return query
+    
+    def _analyze_stats(self, stats: QuestionResponseStats, question_type) -> Optional[Dict[str, Any]]:
+        """
+        Evaluar divergencia en O(1) desde las estadísticas acumuladas
         
         Returns:
-            Dict con question_id como key y lista de respuestas como value
+            Dict con has_divergence/variance/severity, o None si el tipo de
+            pregunta requiere analizar las respuestas completas
         """
-        # Query para obtener respuestas agrupadas por pregunta
-        results = self.db.query(
+        has_divergence = False
+        variance = None
+        severity = AlertSeverity.LOW
+        
+        if question_type in ["single_choice", "yes_no"]:
+            has_divergence = len(stats.answer_counts or {}) > 1
+            
+            if has_divergence and stats.score_count > 1:
+                variance = _sample_variance(stats.score_count, stats.score_m2)
+                severity = _severity_from_score_range(stats.max_score - stats.min_score)
+        
+        elif question_type == "scale":
+            if stats.value_count > 1:
+                variance = _sample_variance(stats.value_count, stats.value_m2)
+                std_dev = math.sqrt(variance)
+                mean = stats.value_mean
+                
+                cv = (std_dev / mean * 100) if mean > 0 else 0
+                has_divergence = cv > 20
+                severity = _severity_from_cv(cv)
+        
+        elif question_type == "multiple_choice":
+            set_counts = Counter()
+            for key, count in (stats.answer_counts or {}).items():
+                set_counts[frozenset(json.loads(key))] += count
+            
+            avg_similarity = _average_jaccard(set_counts)
+            if avg_similarity is not None:
+                has_divergence, variance, severity = _jaccard_divergence(avg_similarity)
+        
+        elif question_type == "text":
+            has_divergence = len(stats.answer_counts or {}) > 1
+        
+        else:
+            return None
+        
+        return {
+            "has_divergence": has_divergence,
+            "variance": variance,
+            "severity": severity
+        }
+    
+    def _responses_query(self, questionnaire_id: int, question_ids: Optional[Set[int]] = None):
+        """Query de respuestas del cuestionario con datos de usuario, área y pregunta"""
+        query = self.db.query(
             QuestionAssignment.question_id,
+            Response.id.label("response_id"),
             User.id.label("user_id"),
             User.full_name.label("user_name"),
             Area.name.label("area_name"),
@@ -98,7 +431,28 @@ class DivergenceService:
             Question, QuestionAssignment.question_id == Question.id
         ).filter(
             QuestionAssignment.questionnaire_id == questionnaire_id
-        ).all()
+        )
+        
+        if question_ids is not None:
+            query = query.filter(QuestionAssignment.question_id.in_(question_ids))
+        
+        return query
+    
+    def _get_questions_with_multiple_responses(
+        self,
+        questionnaire_id: int,
+        question_ids: Optional[Set[int]] = None
+    ) -> Dict[int, Dict]:
+        """
+        Obtener preguntas con múltiples respuestas
+        
+        Args:
+            question_ids: Limitar la consulta a estas preguntas (None = todas)
+        
+        Returns:
+            Dict con question_id como key y lista de respuestas como value
+        """
+        results = self._responses_query(questionnaire_id, question_ids).all()
         
         # Agrupar por pregunta
         grouped = defaultdict(list)
@@ -106,13 +460,7 @@ class DivergenceService:
         question_options = {}
         
         for row in results:
-            grouped[row.question_id].append({
-                "user_id": row.user_id,
-                "user_name": row.user_name,
-                "area_name": row.area_name,
-                "answer": row.answer,
-                "score": row.score
-            })
+            grouped[row.question_id].append(_response_entry(row))
             question_types[row.question_id] = row.question_type
             question_options[row.question_id] = row.options
         
@@ -155,41 +503,15 @@ class DivergenceService:
                 # Calcular severidad basada en diferencia de scores
                 if scores and len(scores) > 1:
                     variance = statistics.variance(scores) if len(scores) > 1 else 0
-                    score_range = max(scores) - min(scores)
-                    
-                    if score_range > 75:
-                        severity = AlertSeverity.CRITICAL
-                    elif score_range > 50:
-                        severity = AlertSeverity.HIGH
-                    elif score_range > 25:
-                        severity = AlertSeverity.MEDIUM
-                    else:
-                        severity = AlertSeverity.LOW
+                    severity = _severity_from_score_range(max(scores) - min(scores))
         
         elif question_type == "multiple_choice":
-            # Para múltiple, calcular overlap
-            answer_sets = [set(a) if isinstance(a, list) else {a} for a in answers]
-            
-            # Calcular índice de Jaccard promedio
-            similarities = []
-            for i in range(len(answer_sets)):
-                for j in range(i + 1, len(answer_sets)):
-                    intersection = len(answer_sets[i] & answer_sets[j])
-                    union = len(answer_sets[i] | answer_sets[j])
-                    if union > 0:
-                        similarities.append(intersection / union)
+            # Para múltiple, calcular overlap (Jaccard promedio entre pares)
+            # desde el histograma de conjuntos de respuestas: O(n + k²)
+            avg_similarity = _average_jaccard(Counter(_answer_set(a) for a in answers))
             
-            if similarities:
-                avg_similarity = sum(similarities) / len(similarities)
-                has_divergence = avg_similarity < 0.8  # 80% de similitud
-                variance = 1 - avg_similarity
-                
-                if avg_similarity < 0.3:
-                    severity = AlertSeverity.CRITICAL
-                elif avg_similarity < 0.5:
-                    severity = AlertSeverity.HIGH
-                elif avg_similarity < 0.7:
-                    severity = AlertSeverity.MEDIUM
+            if avg_similarity is not None:
+                has_divergence, variance, severity = _jaccard_divergence(avg_similarity)
         
         elif question_type == "scale":
             # Para escalas, calcular varianza
@@ -203,13 +525,7 @@ class DivergenceService:
                 cv = (std_dev / mean * 100) if mean > 0 else 0
                 
                 has_divergence = cv > 20  # >20% de variación
-                
-                if cv > 50:
-                    severity = AlertSeverity.CRITICAL
-                elif cv > 40:
-                    severity = AlertSeverity.HIGH
-                elif cv > 30:
-                    severity = AlertSeverity.MEDIUM
+                severity = _severity_from_cv(cv)
         
         elif question_type == "text":
             # Para texto, siempre marcar si hay diferencias significativas
@@ -258,3 +574,300 @@ class DivergenceService:
             self.db.commit()
         
         return alert
+
+
+# ============================================================================
+# RECÁLCULO EN SEGUNDO PLANO
+# ============================================================================
+
+def enqueue_divergence_recalculation(
+    questionnaire_id: int,
+    question_ids: Optional[Iterable[int]] = None,
+    assignment_ids: Optional[Iterable[int]] = None
+) -> Job:
+    """
+    Encolar recálculo de divergencias para un cuestionario
+    
+    Las solicitudes pendientes del mismo cuestionario se combinan: se unen
+    las preguntas a recalcular (y las asignaciones respondidas), y un
+    recálculo completo (question_ids=None) absorbe a los incrementales.
+    
+    Args:
+        assignment_ids: Asignaciones respondidas en el envío que origina el
+                        recálculo (permite actualizar alertas sin recargar
+                        todas sus respuestas)
+    """
+    params = {
+        "question_ids": sorted(set(question_ids)) if question_ids is not None else None,
+        "assignment_ids": sorted(set(assignment_ids)) if assignment_ids is not None else None
+    }
+    return job_queue.enqueue("divergence", questionnaire_id, params, merge=_merge_divergence_params)
+
+
+def _merge_divergence_params(current: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    if current.get("question_ids") is None or new.get("question_ids") is None:
+        return {"question_ids": None, "assignment_ids": None}
+    if current.get("assignment_ids") is None or new.get("assignment_ids") is None:
+        assignment_ids = None
+    else:
+        assignment_ids = sorted(set(current["assignment_ids"]) | set(new["assignment_ids"]))
+    return {
+        "question_ids": sorted(set(current["question_ids"]) | set(new["question_ids"])),
+        "assignment_ids": assignment_ids
+    }
+
+
+@job_queue.handler("divergence")
+def run_divergence_job(job: Job) -> Dict[str, Any]:
+    """Ejecutar un recálculo de divergencias encolado"""
+    db = SessionLocal()
+    try:
+        service = DivergenceService(db)
+        question_ids = job.params.get("question_ids")
+        
+        if question_ids is None:
+            alerts = service.calculate_divergences(job.key)
+        else:
+            alerts = service.update_divergences_for_questions(
+                job.key, question_ids, job.params.get("assignment_ids")
+            )
+        
+        return {
+            "alerts": alerts,
+            "summary": service.get_divergence_summary(job.key)
+        }
+    finally:
+        db.close()
+
+
+# ============================================================================
+# FUNCIONES AUXILIARES
+# ============================================================================
+
+def _severity_from_score_range(score_range: float) -> AlertSeverity:
+    """Severidad según el rango de puntajes (single_choice / yes_no)"""
+    if score_range > 75:
+        return AlertSeverity.CRITICAL
+    elif score_range > 50:
+        return AlertSeverity.HIGH
+    elif score_range > 25:
+        return AlertSeverity.MEDIUM
+    return AlertSeverity.LOW
+
+
+def _severity_from_cv(cv: float) -> AlertSeverity:
+    """Severidad según el coeficiente de variación (escalas)"""
+    if cv > 50:
+        return AlertSeverity.CRITICAL
+    elif cv > 40:
+        return AlertSeverity.HIGH
+    elif cv > 30:
+        return AlertSeverity.MEDIUM
+    return AlertSeverity.LOW
+
+
+def _jaccard_divergence(avg_similarity: float) -> tuple[bool, float, AlertSeverity]:
+    """Divergencia, varianza y severidad según la similitud promedio (multiple_choice)"""
+    has_divergence = avg_similarity < 0.8  # 80% de similitud
+    variance = 1 - avg_similarity
+    
+    if avg_similarity < 0.3:
+        severity = AlertSeverity.CRITICAL
+    elif avg_similarity < 0.5:
+        severity = AlertSeverity.HIGH
+    elif avg_similarity < 0.7:
+        severity = AlertSeverity.MEDIUM
+    else:
+        severity = AlertSeverity.LOW
+    
+    return has_divergence, variance, severity
+
+
+def _same_variance(a: Optional[float], b: Optional[float]) -> bool:
+    """
+    Comparar varianzas tolerando diferencias de redondeo
+    
+    El cálculo incremental (Welford) y el completo (NumPy) difieren en los
+    últimos bits; eso no debe contar como cambio de la alerta.
+    """
+    if a is None or b is None:
+        return a is b
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+
+
+def _answer_set(answer) -> frozenset:
+    """Conjunto de opciones marcadas en una respuesta de selección múltiple"""
+    return frozenset(answer) if isinstance(answer, list) else frozenset([answer])
+
+
+def _average_jaccard(set_counts: Counter) -> Optional[float]:
+    """
+    Índice de Jaccard promedio entre todos los pares de respuestas
+    
+    Calcula exactamente lo mismo que _pairwise_jaccard_reference pero a partir
+    del histograma {conjunto: cantidad}. Cada conjunto distinto se codifica como
+    máscara de bits sobre las opciones, así el costo depende de la cantidad de
+    conjuntos distintos (acotada por las combinaciones de opciones) y no de los
+    pares de usuarios. Los pares de conjuntos vacíos (unión 0) se omiten.
+    
+    Returns:
+        Similitud promedio, o None si no hay pares comparables
+    """
+    bits = {}
+    masks = []
+    for answer_set, count in set_counts.items():
+        if count <= 0:
+            continue
+        mask = 0
+        for value in answer_set:
+            mask |= 1 << bits.setdefault(value, len(bits))
+        masks.append((mask, count))
+    
+    total_similarity = 0.0
+    total_pairs = 0
+    
+    for i, (mask_i, count_i) in enumerate(masks):
+        # Pares dentro del mismo conjunto: similitud 1 (salvo conjunto vacío)
+        if mask_i:
+            same_pairs = count_i * (count_i - 1) // 2
+            total_similarity += same_pairs
+            total_pairs += same_pairs
+        
+        for mask_j, count_j in masks[i + 1:]:
+            union = (mask_i | mask_j).bit_count()
+            if union > 0:
+                pairs = count_i * count_j
+                total_similarity += pairs * (mask_i & mask_j).bit_count() / union
+                total_pairs += pairs
+    
+    if total_pairs == 0:
+        return None
+    return total_similarity / total_pairs
+
+
+def _pairwise_jaccard_reference(answers: List[Any]) -> Optional[float]:
+    """
+    Implementación de referencia O(n²) del Jaccard promedio entre pares
+    
+    Se conserva para validar _average_jaccard; no usar en producción.
+    """
+    answer_sets = [set(a) if isinstance(a, list) else {a} for a in answers]
+    
+    similarities = []
+    for i in range(len(answer_sets)):
+        for j in range(i + 1, len(answer_sets)):
+            intersection = len(answer_sets[i] & answer_sets[j])
+            union = len(answer_sets[i] | answer_sets[j])
+            if union > 0:
+                similarities.append(intersection / union)
+    
+    if not similarities:
+        return None
+    return sum(similarities) / len(similarities)
+
+
+def _response_entry(row) -> Dict[str, Any]:
+    """Respuesta tal como se guarda en DivergenceAlert.responses_data"""
+    return {
+        "user_id": row.user_id,
+        "user_name": row.user_name,
+        "area_name": row.area_name,
+        "answer": row.answer,
+        "score": row.score
+    }
+
+
+def _new_stats(questionnaire_id: int, question_id: int) -> QuestionResponseStats:
+    """Crear acumulador vacío"""
+    return QuestionResponseStats(
+        questionnaire_id=questionnaire_id,
+        question_id=question_id,
+        response_count=0,
+        value_count=0,
+        value_mean=0.0,
+        value_m2=0.0,
+        score_count=0,
+        score_mean=0.0,
+        score_m2=0.0,
+        answer_counts={}
+    )
+
+
+def _stats_values(stats: QuestionResponseStats) -> Dict[str, Any]:
+    """Valores de columna de un acumulador (para insertarlo con un INSERT masivo)"""
+    return {
+        column.key: getattr(stats, column.key)
+        for column in QuestionResponseStats.__table__.columns
+        if column.key not in ("id", "updated_at")
+    }
+
+
+def _welford(count: int, mean: float, m2: float, value: float) -> tuple[int, float, float]:
+    """Agregar un valor a un acumulador de Welford (count, mean, M2)"""
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    m2 += delta * (value - mean)
+    return count, mean, m2
+
+
+def _sample_variance(count: int, m2: float) -> float:
+    """Varianza muestral (igual que statistics.variance) desde M2"""
+    return max(m2, 0.0) / (count - 1)
+
+
+def _answer_key(question_type, answer) -> Optional[str]:
+    """Clave del histograma de respuestas según el tipo de pregunta"""
+    if question_type in ["single_choice", "yes_no"]:
+        return str(answer)
+    if question_type == "text":
+        return str(answer).lower().strip()
+    if question_type == "multiple_choice":
+        try:
+            answer_set = _answer_set(answer)
+        except TypeError:
+            return None  # Respuesta malformada (valores no comparables)
+        return json.dumps(sorted(answer_set, key=repr))
+    return None
+
+
+def _accumulate_rows(
+    questionnaire_id: int,
+    stats_by_question: Dict[int, QuestionResponseStats],
+    rows: Iterable[Any]
+) -> None:
+    """Incorporar filas (question_id, question_type, answer, score) a los acumuladores"""
+    for row in rows:
+        stats = stats_by_question.get(row.question_id)
+        if stats is None:
+            stats = stats_by_question[row.question_id] = _new_stats(questionnaire_id, row.question_id)
+        _accumulate_response(stats, row.question_type, row.answer, row.score)
+
+
+def _accumulate_response(stats: QuestionResponseStats, question_type, answer, score) -> None:
+    """Incorporar una respuesta al acumulador de su pregunta"""
+    stats.response_count += 1
+    
+    if question_type == "scale" and answer is not None:
+        try:
+            value = float(answer)
+        except (TypeError, ValueError):
+            value = None
+        if value is not None:
+            stats.value_count, stats.value_mean, stats.value_m2 = _welford(
+                stats.value_count, stats.value_mean, stats.value_m2, value
+            )
+    
+    if score is not None:
+        stats.score_count, stats.score_mean, stats.score_m2 = _welford(
+            stats.score_count, stats.score_mean, stats.score_m2, score
+        )
+        stats.min_score = score if stats.min_score is None else min(stats.min_score, score)
+        stats.max_score = score if stats.max_score is None else max(stats.max_score, score)
+    
+    key = _answer_key(question_type, answer)
+    if key is not None:
+        # Reasignar el dict para que SQLAlchemy detecte el cambio en la columna JSON
+        counts = dict(stats.answer_counts or {})
+        counts[key] = counts.get(key, 0) + 1
+        stats.answer_counts = counts
@@ -0,0 +1,183 @@
+"""
+Analizador Vectorizado de Divergencias
+Recalcula un cuestionario completo con reducciones agrupadas de NumPy
+"""
+from typing import List, Dict, Any, Sequence
+from collections import Counter, defaultdict
+import math
+
+import numpy as np
+
+from ..models import AlertSeverity
+from .divergence import (
+    _answer_key, _answer_set, _average_jaccard, _jaccard_divergence,
+    _severity_from_score_range, _severity_from_cv
+)
+
+
+class BatchDivergenceAnalyzer:
+    """
+    Analiza todas las respuestas de un cuestionario en una sola pasada
+    
+    Las filas se cargan en arreglos columnares (índice de pregunta, puntaje,
+    valor numérico y respuesta codificada) y las métricas por pregunta
+    (varianza, CV, rango de puntajes, respuestas distintas) se obtienen con
+    reducciones agrupadas. Produce el mismo resultado que aplicar
+    DivergenceService._analyze_divergence pregunta por pregunta.
+    """
+    
+    def __init__(self, rows: Sequence[Any]):
+        """
+        Args:
+            rows: Filas con question_id, user_id, user_name, area_name,
+                  answer, score y question_type
+        """
+        self.rows = rows
+        
+        question_index: Dict[int, int] = {}
+        answer_codes: Dict[str, int] = {}
+        self.question_ids: List[int] = []
+        self.question_types: List[Any] = []
+        
+        n = len(rows)
+        self.q_idx = np.empty(n, dtype=np.int64)
+        self.scores = np.full(n, np.nan)
+        self.values = np.full(n, np.nan)
+        self.codes = np.full(n, -1, dtype=np.int64)
+        
+        for i, row in enumerate(rows):
+            q = question_index.get(row.question_id)
+            if q is None:
+                q = question_index[row.question_id] = len(self.question_ids)
+                self.question_ids.append(row.question_id)
+                self.question_types.append(row.question_type)
+            self.q_idx[i] = q
+            
+            if row.score is not None:
+                self.scores[i] = row.score
+            
+            if row.question_type == "scale" and row.answer is not None:
+                try:
+                    self.values[i] = float(row.answer)
+                except (TypeError, ValueError):
+                    pass
+            
+            key = _answer_key(row.question_type, row.answer)
+            if key is not None:
+                self.codes[i] = answer_codes.setdefault(key, len(answer_codes))
+        
+        self.n_questions = len(self.question_ids)
+        self.n_codes = max(len(answer_codes), 1)
+    
+    def analyze(self) -> Dict[int, Dict[str, Any]]:
+        """
+        Analizar todas las preguntas con más de una respuesta
+        
+        Returns:
+            Dict question_id -> {has_divergence, variance, severity, responses}
+        """
+        counts = np.bincount(self.q_idx, minlength=self.n_questions)
+        score_n, score_mean, score_var = self._grouped_variance(self.scores)
+        value_n, value_mean, value_var = self._grouped_variance(self.values)
+        score_min, score_max = self._grouped_min_max(self.scores)
+        distinct = self._grouped_distinct(self.codes)
+        answer_sets = self._grouped_answer_sets()
+        
+        analyses = {}
+        for q, question_id in enumerate(self.question_ids):
+            if counts[q] < 2:
+                continue
+            
+            question_type = self.question_types[q]
+            has_divergence = False
+            variance = None
+            severity = AlertSeverity.LOW
+            
+            if question_type in ["single_choice", "yes_no"]:
+                has_divergence = distinct[q] > 1
+                if has_divergence and score_n[q] > 1:
+                    variance = float(score_var[q])
+                    severity = _severity_from_score_range(float(score_max[q] - score_min[q]))
+            
+            elif question_type == "multiple_choice":
+                avg_similarity = _average_jaccard(answer_sets.get(q, Counter()))
+                if avg_similarity is not None:
+                    has_divergence, variance, severity = _jaccard_divergence(avg_similarity)
+            
+            elif question_type == "scale":
+                if value_n[q] > 1:
+                    variance = float(value_var[q])
+                    std_dev = math.sqrt(variance)
+                    mean = float(value_mean[q])
+                    cv = (std_dev / mean * 100) if mean > 0 else 0
+                    has_divergence = cv > 20
+                    severity = _severity_from_cv(cv)
+            
+            elif question_type == "text":
+                has_divergence = distinct[q] > 1
+            
+            analyses[question_id] = {
+                "has_divergence": has_divergence,
+                "variance": variance,
+                "severity": severity,
+                "responses": None
+            }
+        
+        self._attach_responses(analyses)
+        return analyses
+    
+    def _grouped_variance(self, x: np.ndarray):
+        """Cantidad, media y varianza muestral por pregunta (ignora NaN)"""
+        valid = ~np.isnan(x)
+        q = self.q_idx[valid]
+        x = x[valid]
+        
+        n = np.bincount(q, minlength=self.n_questions)
+        sums = np.bincount(q, weights=x, minlength=self.n_questions)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = sums / n
+            squares = np.bincount(q, weights=(x - mean[q]) ** 2, minlength=self.n_questions)
+            var = squares / (n - 1)
+        return n, mean, var
+    
+    def _grouped_min_max(self, x: np.ndarray):
+        """Mínimo y máximo por pregunta (ignora NaN)"""
+        valid = ~np.isnan(x)
+        mins = np.full(self.n_questions, np.inf)
+        maxs = np.full(self.n_questions, -np.inf)
+        np.minimum.at(mins, self.q_idx[valid], x[valid])
+        np.maximum.at(maxs, self.q_idx[valid], x[valid])
+        return mins, maxs
+    
+    def _grouped_distinct(self, codes: np.ndarray) -> np.ndarray:
+        """Cantidad de respuestas distintas por pregunta"""
+        valid = codes >= 0
+        pairs = np.unique(self.q_idx[valid] * self.n_codes + codes[valid])
+        return np.bincount(pairs // self.n_codes, minlength=self.n_questions)
+    
+    def _grouped_answer_sets(self) -> Dict[int, Counter]:
+        """Histograma de conjuntos de respuestas para preguntas multiple_choice"""
+        histograms: Dict[int, Counter] = defaultdict(Counter)
+        for i, row in enumerate(self.rows):
+            if row.question_type == "multiple_choice":
+                histograms[int(self.q_idx[i])][_answer_set(row.answer)] += 1
+        return histograms
+    
+    def _attach_responses(self, analyses: Dict[int, Dict[str, Any]]) -> None:
+        """Armar la lista de respuestas solo para las preguntas divergentes"""
+        divergent = {
+            question_id for question_id, info in analyses.items()
+            if info["has_divergence"]
+        }
+        responses = defaultdict(list)
+        for row in self.rows:
+            if row.question_id in divergent:
+                responses[row.question_id].append({
+                    "user_id": row.user_id,
+                    "user_name": row.user_name,
+                    "area_name": row.area_name,
+                    "answer": row.answer,
+                    "score": row.score
+                })
+        for question_id, info in analyses.items():
+            info["responses"] = responses.get(question_id, [])
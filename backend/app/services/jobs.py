@@ -0,0 +1,252 @@
+"""
+Cola de Trabajos en Segundo Plano
+Ejecuta tareas pesadas fuera del request en un pool de hilos local (sin broker externo)
+"""
+import os
+import enum
+import uuid
+import queue
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional, Hashable
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "500"))
+JOB_SHUTDOWN_TIMEOUT = float(os.getenv("JOB_SHUTDOWN_TIMEOUT", "30"))  # segundos
+
+
+class JobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class Job:
+    """Trabajo encolado"""
+    
+    def __init__(self, kind: str, key: Hashable, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.params = params
+        self.status = JobStatus.PENDING
+        self.requests = 1  # Cantidad de solicitudes combinadas en este trabajo
+        self.progress: Optional[Dict[str, Any]] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._done = threading.Event()
+    
+    def set_progress(self, done: int, total: Optional[int] = None) -> None:
+        """Actualizar el avance reportado por el handler"""
+        self.progress = {"done": done, "total": total}
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Esperar a que el trabajo termine (True si terminó)"""
+        return self._done.wait(timeout)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "status": self.status.value,
+            "requests": self.requests,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobQueue:
+    """
+    Cola de trabajos en memoria con pool de workers
+    
+    - Las solicitudes repetidas para el mismo (kind, key) se combinan en un
+      único trabajo pendiente.
+    - Nunca se ejecutan en paralelo dos trabajos con el mismo (kind, key): si
+      llega uno mientras otro corre, espera a que éste termine.
+    - Una vez iniciado shutdown() los trabajos nuevos, y los que esperaban a
+      otro del mismo (kind, key), se descartan (quedan como fallidos) y los
+      workers no se vuelven a iniciar hasta un start().
+    """
+    
+    def __init__(self, workers: int = JOB_WORKERS, history_size: int = JOB_HISTORY_SIZE):
+        self._workers = max(1, workers)
+        self._history_size = history_size
+        self._handlers: Dict[str, Callable[[Job], Any]] = {}
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._pending: Dict[tuple, Job] = {}
+        self._deferred: Dict[tuple, Job] = {}
+        self._running: set = set()
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: list = []
+        self._closed = False
+    
+    def handler(self, kind: str):
+        """Decorador para registrar el handler de un tipo de trabajo"""
+        def decorator(func: Callable[[Job], Any]):
+            self._handlers[kind] = func
+            return func
+        return decorator
+    
+    def enqueue(
+        self,
+        kind: str,
+        key: Hashable,
+        params: Optional[Dict[str, Any]] = None,
+        merge: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]] = None
+    ) -> Job:
+        """
+        Encolar un trabajo
+        
+        Args:
+            kind: Tipo de trabajo (debe tener handler registrado)
+            key: Clave de coalescencia (p.ej. id del cuestionario)
+            params: Parámetros para el handler
+            merge: Función para combinar params con un trabajo pendiente existente
+        
+        Returns:
+            El trabajo creado o el pendiente con el que se combinó
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"No hay handler registrado para '{kind}'")
+        
+        params = params or {}
+        slot = (kind, key)
+        
+        with self._lock:
+            if self._closed:
+                # Ej.: un trabajo que encadena otro mientras la aplicación se detiene
+                job = Job(kind, key, params)
+                self._remember(job)
+                self._discard(job)
+                return job
+            
+            job = self._pending.get(slot)
+            if job is not None:
+                job.params = merge(job.params, params) if merge else params
+                job.requests += 1
+                return job
+            
+            job = Job(kind, key, params)
+            self._pending[slot] = job
+            self._remember(job)
+            self._ensure_started()
+        
+        self._queue.put(job)
+        return job
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        """Obtener un trabajo por id (solo los más recientes se conservan)"""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def start(self) -> None:
+        """Iniciar los workers (reabre la cola si se había detenido)"""
+        with self._lock:
+            self._closed = False
+            self._ensure_started()
+    
+    def shutdown(self, wait: bool = True, timeout: float = JOB_SHUTDOWN_TIMEOUT) -> None:
+        """
+        Detener los workers
+        
+        Los trabajos ya encolados y los en curso terminan; los que se encolen
+        desde ahora se descartan.
+        
+        Args:
+            timeout: Espera máxima total por los workers (segundos)
+        """
+        with self._lock:
+            self._closed = True
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            deadline = time.monotonic() + timeout
+            for thread in threads:
+                thread.join(max(0.0, deadline - time.monotonic()))
+            alive = [thread.name for thread in threads if thread.is_alive()]
+            if alive:
+                logger.warning(f"Workers sin terminar tras {timeout}s: {', '.join(alive)}")
+    
+    def _ensure_started(self) -> None:
+        if self._threads or self._closed:
+            return
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def _discard(self, job: Job) -> None:
+        """Marcar como fallido un trabajo que no se ejecutará porque la cola se detiene (con el lock tomado)"""
+        job.status = JobStatus.FAILED
+        job.error = "La cola de trabajos se está deteniendo"
+        job.finished_at = datetime.utcnow()
+        job._done.set()
+        logger.warning(f"Trabajo {job.kind} ({job.key}) descartado: la cola se está deteniendo")
+    
+    def _remember(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        while len(self._jobs) > self._history_size:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status in (JobStatus.PENDING, JobStatus.RUNNING):
+                break
+            del self._jobs[oldest_id]
+    
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            
+            slot = (job.kind, job.key)
+            with self._lock:
+                if slot in self._running:
+                    # Se re-encola cuando termine el que está en ejecución
+                    self._deferred[slot] = job
+                    continue
+                if self._pending.get(slot) is job:
+                    del self._pending[slot]
+                self._running.add(slot)
+                job.status = JobStatus.RUNNING
+                job.started_at = datetime.utcnow()
+            
+            try:
+                job.result = self._handlers[job.kind](job)
+                job.status = JobStatus.COMPLETED
+            except Exception as e:
+                logger.exception(f"Error en trabajo {job.kind} ({job.key})")
+                job.error = str(e)
+                job.status = JobStatus.FAILED
+            finally:
+                job.finished_at = datetime.utcnow()
+                job._done.set()
+                with self._lock:
+                    self._running.discard(slot)
+                    deferred = self._deferred.pop(slot, None)
+                    if deferred is not None and self._closed:
+                        # Re-encolado quedaría detrás de las señales de término, sin worker que lo tome
+                        if self._pending.get(slot) is deferred:
+                            del self._pending[slot]
+                        self._discard(deferred)
+                        deferred = None
+                if deferred is not None:
+                    self._queue.put(deferred)
+
+
+# Cola compartida por la aplicación
+job_queue = JobQueue()
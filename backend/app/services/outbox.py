@@ -0,0 +1,375 @@
+"""
+Bandeja de Salida de Correos
+send_tokens solo encola; un worker asíncrono envía por lotes y confirma cada
+lote, de modo que un envío interrumpido se retoma donde quedó
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, or_, update
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from ..models import (
+    EmailOutbox, OutboxStatus, AccessToken, TokenStatus, User,
+    QuestionnaireAssignment, Company, SMTPConfig
+)
+from ..utils.email import EmailService, MessagePrototype, get_email_template
+from ..utils.mailer import AsyncMailer, MailResult, record_send_result
+from .reminders import next_reminder_time
+from .token_status import token_status_cache
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "200"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", "60"))  # segundos (se duplica por intento)
+OUTBOX_CLAIM_TIMEOUT = float(os.getenv("OUTBOX_CLAIM_TIMEOUT", "600"))  # segundos en SENDING antes de retomar
+
+# Intentos de reservar un lote cuando otro worker toma parte de las mismas filas
+CLAIM_RETRIES = 3
+
+# Asunto por tipo de correo
+SUBJECTS = {
+    "questionnaire": "[{company}] Cuestionario de Cumplimiento - {questionnaire}",
+    "reminder": "[{company}] Recordatorio: {questionnaire}"
+}
+
+
+def enqueue_emails(db, items: Sequence[Dict[str, Any]]) -> int:
+    """
+    Encolar correos en la bandeja de salida con un solo INSERT (sin commit)
+    
+    Args:
+        items: [{company_id, access_token_id, to_email, kind}]
+    
+    Returns:
+        int: Cantidad de correos encolados
+    """
+    if not items:
+        return 0
+    
+    now = datetime.utcnow()
+    db.execute(insert(EmailOutbox), [
+        {
+            "company_id": item["company_id"],
+            "access_token_id": item["access_token_id"],
+            "to_email": item["to_email"],
+            "kind": item.get("kind", "questionnaire"),
+            "status": OutboxStatus.PENDING,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        }
+        for item in items
+    ])
+    return len(items)
+
+
+class OutboxWorker:
+    """
+    Worker asíncrono que vacía la bandeja de salida
+    
+    Cada lote se reserva (estado SENDING) y se confirma antes de enviar, y los
+    resultados se confirman al terminar el lote. Las reservas con más de
+    OUTBOX_CLAIM_TIMEOUT segundos (lotes de un proceso que se cayó) vuelven
+    a PENDING; las de otros workers vivos no se tocan.
+    """
+    
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+    
+    def start(self) -> None:
+        """Iniciar el worker en el event loop actual"""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Detener el worker (el lote en curso se interrumpe y se retoma al reiniciar)"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    def notify(self) -> None:
+        """Despertar al worker (hay correos nuevos)"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def _run(self) -> None:
+        while True:
+            try:
+                sent = await self.drain_once()
+            except Exception:
+                logger.exception("Error procesando la bandeja de salida")
+                sent = 0
+            
+            if sent:
+                continue  # Puede haber más pendientes
+            
+            try:
+                await run_in_threadpool(_release_stale)
+            except Exception:
+                logger.exception("Error retomando correos reservados")
+            
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    async def drain_once(self) -> int:
+        """
+        Enviar un lote de correos pendientes
+        
+        Returns:
+            int: Cantidad de correos procesados (0 si no había pendientes)
+        """
+        groups, results = await run_in_threadpool(_claim_batch, self.batch_size)
+        if not groups and not results:
+            return 0
+        
+        for company_id, email_service, messages in groups:
+            mailer = AsyncMailer(email_service, company_id=company_id)
+            results.extend(await mailer.send_messages(messages))
+        
+        await run_in_threadpool(_record_results, results)
+        return len(results)
+
+
+def _release_stale(timeout: float = OUTBOX_CLAIM_TIMEOUT) -> None:
+    """Devolver a PENDING los correos reservados hace más de timeout segundos (proceso interrumpido)"""
+    db = SessionLocal()
+    try:
+        released = db.query(EmailOutbox).filter(
+            EmailOutbox.status == OutboxStatus.SENDING,
+            or_(
+                EmailOutbox.claimed_at.is_(None),
+                EmailOutbox.claimed_at < datetime.utcnow() - timedelta(seconds=timeout)
+            )
+        ).update({EmailOutbox.status: OutboxStatus.PENDING}, synchronize_session=False)
+        db.commit()
+        if released:
+            logger.info(f"{released} correos pendientes retomados")
+    finally:
+        db.close()
+
+
+def _due_rows(db, batch_size: int):
+    """Correos pendientes y vencidos, con los datos necesarios para armar el mensaje"""
+    return db.query(
+        EmailOutbox.id,
+        EmailOutbox.company_id,
+        EmailOutbox.access_token_id,
+        EmailOutbox.kind,
+        EmailOutbox.to_email,
+        AccessToken.token,
+        AccessToken.status.label("token_status"),
+        AccessToken.expires_at,
+        User.full_name.label("user_name"),
+        QuestionnaireAssignment.name.label("questionnaire_name"),
+        QuestionnaireAssignment.end_date.label("deadline"),
+        Company.name.label("company_name")
+    ).join(
+        AccessToken, EmailOutbox.access_token_id == AccessToken.id
+    ).join(
+        User, AccessToken.user_id == User.id
+    ).join(
+        QuestionnaireAssignment, AccessToken.questionnaire_id == QuestionnaireAssignment.id
+    ).join(
+        Company, EmailOutbox.company_id == Company.id
+    ).filter(
+        EmailOutbox.status == OutboxStatus.PENDING,
+        EmailOutbox.next_attempt_at <= datetime.utcnow()
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(batch_size).all()
+
+
+def _claim_batch(batch_size: int) -> Tuple[List[Tuple[int, EmailService, List[Tuple[Any, Any]]]], List[MailResult]]:
+    """
+    Reservar un lote de correos vencidos y armar sus mensajes
+    
+    Un correo cuyo mensaje no se puede armar no detiene el lote: se devuelve
+    como fallo definitivo para que _record_results lo marque FAILED. Los
+    recordatorios de tokens ya completados o expirados se cancelan (FAILED)
+    sin enviarse.
+    
+    Returns:
+        ([(company_id, EmailService, [((outbox_id, access_token_id, kind), mensaje)])], fallos)
+    """
+    db = SessionLocal()
+    try:
+        for _ in range(CLAIM_RETRIES):
+            rows = _due_rows(db, batch_size)
+            if not rows:
+                return [], []
+            
+            # Solo se reservan filas aún PENDING; si otro worker tomó alguna, se
+            # deshace la reserva y se vuelve a leer en vez de enviarla dos veces
+            claimed = db.execute(
+                update(EmailOutbox).where(
+                    EmailOutbox.id.in_([row.id for row in rows]),
+                    EmailOutbox.status == OutboxStatus.PENDING
+                ).values(status=OutboxStatus.SENDING, claimed_at=datetime.utcnow())
+            ).rowcount
+            if claimed == len(rows):
+                break
+            db.rollback()
+        else:
+            return [], []
+        
+        now = datetime.utcnow()
+        cancelled = [
+            row.id for row in rows
+            if row.kind == "reminder" and (
+                row.token_status not in (TokenStatus.SENT, TokenStatus.OPENED)
+                or (row.expires_at and row.expires_at <= now)
+            )
+        ]
+        if cancelled:
+            db.execute(
+                update(EmailOutbox).where(EmailOutbox.id.in_(cancelled)).values(
+                    status=OutboxStatus.FAILED,
+                    last_error="Recordatorio cancelado: el token ya no está pendiente de respuesta"
+                )
+            )
+            cancelled = set(cancelled)
+            rows = [row for row in rows if row.id not in cancelled]
+        db.commit()
+        
+        company_ids = {row.company_id for row in rows}
+        smtp_configs = {
+            config.company_id: config
+            for config in db.query(SMTPConfig).filter(
+                SMTPConfig.company_id.in_(company_ids),
+                SMTPConfig.is_active == True
+            )
+        }
+        
+        services: Dict[int, EmailService] = {}
+        prototypes: Dict[tuple, MessagePrototype] = {}
+        messages: Dict[int, List[Tuple[Any, Any]]] = {}
+        failed: List[MailResult] = []
+        for row in rows:
+            key = (row.id, row.access_token_id, row.kind)
+            try:
+                service = services.get(row.company_id)
+                if service is None:
+                    service = services[row.company_id] = EmailService(smtp_configs.get(row.company_id))
+                
+                # Una estructura MIME y plantilla por campaña; por destinatario solo se completa
+                kind = row.kind if row.kind in SUBJECTS else "questionnaire"
+                prototype_key = (row.company_id, kind, row.company_name, row.questionnaire_name, row.deadline)
+                prototype = prototypes.get(prototype_key)
+                if prototype is None:
+                    prototype = prototypes[prototype_key] = MessagePrototype(
+                        service,
+                        SUBJECTS[kind].format(company=row.company_name, questionnaire=row.questionnaire_name),
+                        get_email_template(kind, row.company_name, row.questionnaire_name, row.deadline)
+                    )
+                
+                msg = prototype.render(row.to_email, row.user_name, row.token)
+            except Exception as e:
+                logger.exception(f"No se pudo armar el correo para {row.to_email}")
+                result = MailResult(key, row.to_email)
+                result.error = f"Error armando el mensaje: {e}"
+                result.permanent = True
+                failed.append(result)
+                continue
+            
+            messages.setdefault(row.company_id, []).append((key, msg))
+        
+        groups = [
+            (company_id, services[company_id], company_messages)
+            for company_id, company_messages in messages.items()
+        ]
+        return groups, failed
+    finally:
+        db.close()
+
+
+def _record_results(results: List[MailResult]) -> None:
+    """Guardar el resultado de un lote en la bandeja y en los tokens (un commit por lote)"""
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        
+        outbox = {
+            row.id: row
+            for row in db.query(EmailOutbox.id, EmailOutbox.attempts).filter(
+                EmailOutbox.id.in_([result.key[0] for result in results])
+            )
+        }
+        tokens = {
+            token.id: token
+            for token in db.query(AccessToken).filter(
+                AccessToken.id.in_({result.key[1] for result in results})
+            )
+        }
+        questionnaires = {
+            questionnaire.id: questionnaire
+            for questionnaire in db.query(QuestionnaireAssignment).filter(
+                QuestionnaireAssignment.id.in_({token.questionnaire_id for token in tokens.values()})
+            )
+        }
+        
+        changes = []
+        sent_hashes = []
+        for result in results:
+            outbox_id, access_token_id, kind = result.key
+            attempts = (outbox[outbox_id].attempts or 0) + 1 if outbox_id in outbox else 1
+            
+            if result.success:
+                status = OutboxStatus.SENT
+            elif attempts < OUTBOX_MAX_ATTEMPTS and not result.permanent:
+                status = OutboxStatus.PENDING
+            else:
+                status = OutboxStatus.FAILED
+            
+            changes.append({
+                "id": outbox_id,
+                "status": status,
+                "attempts": attempts,
+                "last_error": result.error[:500] if result.error else None,
+                "next_attempt_at": now + timedelta(seconds=OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)),
+                "sent_at": now if result.success else None
+            })
+            
+            token = tokens.get(access_token_id)
+            if token is None:
+                continue
+            
+            record_send_result(token, result, now, mark_sent=kind == "questionnaire")
+            if result.success and kind == "questionnaire":
+                sent_hashes.append(token.token_hash)
+            
+            # Programar el siguiente recordatorio cuando el correo ya no se reintentará
+            if status != OutboxStatus.PENDING:
+                if kind == "reminder" and result.success:
+                    token.reminders_sent = (token.reminders_sent or 0) + 1
+                if token.status in (TokenStatus.SENT, TokenStatus.OPENED):
+                    token.next_reminder_at = next_reminder_time(
+                        token, questionnaires[token.questionnaire_id], now
+                    )
+        
+        db.execute(update(EmailOutbox), changes)
+        db.commit()
+        token_status_cache.invalidate(sent_hashes)
+    finally:
+        db.close()
+
+
+# Worker compartido por la aplicación
+outbox_worker = OutboxWorker()
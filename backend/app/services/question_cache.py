@@ -0,0 +1,110 @@
+"""
+Caché de Preguntas Precompiladas
+Guarda la versión pública de cada pregunta ya convertida a modelos Pydantic y
+su calculador de puntaje, versionados por updated_at, para no reconstruirlos
+en cada apertura o envío de encuesta
+"""
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Any
+
+from sqlalchemy.orm import Session
+
+from ..models import Question
+from ..schemas import PublicQuestion, QuestionOption, QuestionTypeEnum
+from ..utils.cache import TTLCache
+from .scoring import QuestionScorer
+
+QUESTION_CACHE_TTL = float(os.getenv("QUESTION_CACHE_TTL", "3600"))
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "5000"))
+
+
+class CachedQuestion:
+    """Pregunta precompilada (payload público y puntaje) para una versión (updated_at) concreta"""
+    
+    __slots__ = ("question_id", "version", "fields", "scorer")
+    
+    def __init__(self, question: Question):
+        self.question_id = question.id
+        self.version = question.updated_at
+        self.scorer = QuestionScorer(question)
+        
+        options = None
+        if question.options:
+            options = [
+                QuestionOption(
+                    value=opt.get("value", ""),
+                    text=opt.get("text", ""),
+                    score=opt.get("score", 0)
+                )
+                for opt in question.options
+            ]
+        
+        self.fields: Dict[str, Any] = {
+            "question_id": question.id,
+            "text": question.text,
+            "description": question.description,
+            "question_type": QuestionTypeEnum(question.question_type.value),
+            "options": options,
+            "required": question.required
+        }
+    
+    def render(self, assignment_id: int, order: int) -> PublicQuestion:
+        """Armar la pregunta pública para una asignación (sin revalidar)"""
+        return PublicQuestion.model_construct(
+            assignment_id=assignment_id,
+            order=order,
+            **self.fields
+        )
+
+
+class QuestionCache:
+    """
+    Caché en proceso de preguntas precompiladas
+    
+    Cada entrada guarda el updated_at con que se compiló; si la pregunta
+    cambia (en este u otro proceso) la versión no coincide y se recompila.
+    """
+    
+    def __init__(self, ttl: float = QUESTION_CACHE_TTL, maxsize: int = QUESTION_CACHE_SIZE):
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+    
+    def get_many(self, db: Session, versions: Dict[int, Optional[datetime]]) -> Dict[int, CachedQuestion]:
+        """
+        Obtener preguntas precompiladas
+        
+        Args:
+            versions: Dict question_id -> updated_at actual en la BD
+        
+        Returns:
+            Dict question_id -> CachedQuestion (las faltantes se cargan en una sola consulta)
+        """
+        found: Dict[int, CachedQuestion] = {}
+        missing = []
+        
+        for question_id, version in versions.items():
+            entry = self._cache.get(question_id)
+            if entry is not None and entry.version == version:
+                found[question_id] = entry
+            else:
+                missing.append(question_id)
+        
+        if missing:
+            for question in db.query(Question).filter(Question.id.in_(missing)):
+                entry = CachedQuestion(question)
+                self._cache.set(question.id, entry)
+                found[question.id] = entry
+        
+        return found
+    
+    def invalidate(self, question_ids: Iterable[int]) -> None:
+        """Descartar preguntas modificadas"""
+        for question_id in question_ids:
+            self._cache.pop(question_id)
+    
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+# Caché compartida por la aplicación
+question_cache = QuestionCache()
@@ -0,0 +1,239 @@
+"""
+Recordatorios Automáticos
+Un barrido periódico toma los tokens SENT/OPENED con recordatorio vencido
+(índice por estado + next_reminder_at) y los encola en la bandeja de salida
+"""
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from ..database import SessionLocal
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import Session
+
+from ..models import (
+    AccessToken, TokenStatus, User, QuestionnaireAssignment, EmailOutbox, OutboxStatus
+)
+
+logger = logging.getLogger(__name__)
+
+REMINDER_SWEEP_INTERVAL = float(os.getenv("REMINDER_SWEEP_INTERVAL", "300"))  # segundos
+REMINDER_SWEEP_BATCH = int(os.getenv("REMINDER_SWEEP_BATCH", "1000"))
+REMINDER_MAX_COUNT = int(os.getenv("REMINDER_MAX_COUNT", "3"))
+
+
+def next_reminder_time(
+    access_token: AccessToken,
+    questionnaire: QuestionnaireAssignment,
+    from_time: datetime
+) -> Optional[datetime]:
+    """
+    Calcular el próximo recordatorio de un token
+    
+    Returns:
+        Fecha del recordatorio, o None si el cuestionario no envía
+        recordatorios, ya se enviaron REMINDER_MAX_COUNT o vencería después
+        de la fecha límite.
+    """
+    if not questionnaire.send_reminders or not questionnaire.reminder_days:
+        return None
+    if (access_token.reminders_sent or 0) >= REMINDER_MAX_COUNT:
+        return None
+    
+    next_at = from_time + timedelta(days=questionnaire.reminder_days)
+    deadline = access_token.expires_at or questionnaire.end_date
+    if deadline and next_at >= deadline:
+        return None
+    return next_at
+
+
+def schedule_missing_reminders(
+    db: Session,
+    questionnaire_id: Optional[int] = None,
+    batch_size: int = REMINDER_SWEEP_BATCH
+) -> int:
+    """
+    Programar el recordatorio de tokens SENT/OPENED que no tienen uno (sin commit)
+    
+    Cubre los tokens enviados antes de existir next_reminder_at y los de
+    cuestionarios que vuelven a activar los recordatorios. Se omiten los que
+    tienen un recordatorio en la bandeja de salida (la bandeja programa el
+    siguiente al procesarlo). El próximo se cuenta desde el último envío.
+    
+    Returns:
+        int: Cantidad de tokens programados
+    """
+    in_outbox = exists().where(and_(
+        EmailOutbox.access_token_id == AccessToken.id,
+        EmailOutbox.kind == "reminder",
+        EmailOutbox.status.in_([OutboxStatus.PENDING, OutboxStatus.SENDING])
+    ))
+    query = db.query(AccessToken, QuestionnaireAssignment).join(
+        QuestionnaireAssignment, AccessToken.questionnaire_id == QuestionnaireAssignment.id
+    ).filter(
+        AccessToken.status.in_([TokenStatus.SENT, TokenStatus.OPENED]),
+        AccessToken.next_reminder_at.is_(None),
+        QuestionnaireAssignment.send_reminders == True,
+        QuestionnaireAssignment.reminder_days > 0,
+        ~in_outbox
+    )
+    if questionnaire_id is not None:
+        query = query.filter(AccessToken.questionnaire_id == questionnaire_id)
+    
+    now = datetime.utcnow()
+    scheduled = 0
+    last_id = 0
+    while True:
+        rows = query.filter(AccessToken.id > last_id).order_by(AccessToken.id).limit(batch_size).all()
+        if not rows:
+            break
+        
+        for token, questionnaire in rows:
+            token.next_reminder_at = next_reminder_time(
+                token, questionnaire, token.last_send_attempt_at or token.sent_at or now
+            )
+            if token.next_reminder_at is not None:
+                scheduled += 1
+        db.flush()
+        last_id = rows[-1][0].id
+    
+    return scheduled
+
+
+def backfill_reminders() -> int:
+    """Programar los recordatorios faltantes de todos los cuestionarios (un commit)"""
+    db = SessionLocal()
+    try:
+        scheduled = schedule_missing_reminders(db)
+        db.commit()
+        if scheduled:
+            logger.info(f"{scheduled} recordatorios programados")
+        return scheduled
+    finally:
+        db.close()
+
+
+def sweep_due_reminders(batch_size: int = REMINDER_SWEEP_BATCH) -> int:
+    """
+    Encolar los recordatorios vencidos
+    
+    Cada token tomado queda sin next_reminder_at hasta que su correo se
+    procesa (la bandeja programa el siguiente), así un barrido no vuelve a
+    encolarlo. Los tokens cuyo cuestionario ya no corresponde recordar solo
+    se desprograman. Se confirma por lote.
+    
+    Returns:
+        int: Cantidad de recordatorios encolados
+    """
+    from .outbox import enqueue_emails
+    
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        queued = 0
+        
+        while True:
+            rows = db.query(
+                AccessToken.id,
+                AccessToken.expires_at,
+                User.email,
+                User.is_active.label("user_active"),
+                QuestionnaireAssignment.company_id,
+                QuestionnaireAssignment.is_active.label("questionnaire_active"),
+                QuestionnaireAssignment.send_reminders,
+                QuestionnaireAssignment.end_date
+            ).join(
+                User, AccessToken.user_id == User.id
+            ).join(
+                QuestionnaireAssignment, AccessToken.questionnaire_id == QuestionnaireAssignment.id
+            ).filter(
+                AccessToken.status.in_([TokenStatus.SENT, TokenStatus.OPENED]),
+                AccessToken.next_reminder_at <= now
+            ).order_by(AccessToken.next_reminder_at).limit(batch_size).all()
+            
+            if not rows:
+                break
+            
+            items = [
+                {
+                    "company_id": row.company_id,
+                    "access_token_id": row.id,
+                    "to_email": row.email,
+                    "kind": "reminder"
+                }
+                for row in rows
+                if row.user_active
+                and row.questionnaire_active
+                and row.send_reminders
+                and not (row.expires_at and row.expires_at <= now)
+                and not (row.end_date and row.end_date <= now)
+            ]
+            
+            db.query(AccessToken).filter(
+                AccessToken.id.in_([row.id for row in rows])
+            ).update({AccessToken.next_reminder_at: None}, synchronize_session=False)
+            queued += enqueue_emails(db, items)
+            db.commit()
+            
+            if len(rows) < batch_size:
+                break
+        
+        if queued:
+            logger.info(f"{queued} recordatorios encolados")
+        return queued
+    finally:
+        db.close()
+
+
+class ReminderScheduler:
+    """Barrido periódico de recordatorios en el event loop de la aplicación"""
+    
+    def __init__(self, interval: float = REMINDER_SWEEP_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self) -> None:
+        """Iniciar el barrido periódico"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Detener el barrido periódico"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    
+    async def run_once(self) -> int:
+        """Ejecutar un barrido y despertar a la bandeja de salida"""
+        from .outbox import outbox_worker
+        
+        queued = await run_in_threadpool(sweep_due_reminders)
+        if queued:
+            outbox_worker.notify()
+        return queued
+    
+    async def _run(self) -> None:
+        try:
+            await run_in_threadpool(backfill_reminders)
+        except Exception:
+            logger.exception("Error programando recordatorios faltantes")
+        
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Error en el barrido de recordatorios")
+            await asyncio.sleep(self.interval)
+
+
+# Planificador compartido por la aplicación
+reminder_scheduler = ReminderScheduler()
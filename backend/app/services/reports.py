@@ -1,23 +1,66 @@
 """
 Servicio de Reportes y Exportación
 """
-from typing import List, Dict, Any, Optional
+import os
+from itertools import chain
+from typing import List, Dict, Any, Optional, Union, BinaryIO, Iterator
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from io import BytesIO
+from sqlalchemy import func, event
 from datetime import datetime
 import json
 
 from openpyxl import Workbook
-from openpyxl.styles import Font, Fill, PatternFill, Alignment, Border, Side
-from openpyxl.chart import RadarChart, BarChart, Reference
-from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 
 from ..models import (
     Company, Area, User, Question, Category,
     QuestionnaireAssignment, QuestionAssignment, Response,
     DivergenceAlert, AlertSeverity
 )
+from ..utils.cache import TTLCache
+
+# Caché de estadísticas del dashboard (clave: company_id o None)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+_dashboard_cache = TTLCache(ttl=DASHBOARD_CACHE_TTL, maxsize=256)
+
+# Modelos cuyos cambios invalidan las estadísticas del dashboard
+_DASHBOARD_MODELS = (
+    Company, Area, User, Question, QuestionnaireAssignment,
+    QuestionAssignment, Response, DivergenceAlert
+)
+
+
+def invalidate_dashboard_cache() -> None:
+    """Descartar las estadísticas del dashboard en caché"""
+    _dashboard_cache.clear()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_dashboard_changes(session, flush_context):
+    """Marcar la sesión si el flush tocó tablas del dashboard"""
+    if any(isinstance(obj, _DASHBOARD_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        session.info["dashboard_dirty"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_dashboard_bulk_changes(orm_execute_state):
+    """Marcar la sesión ante INSERT/UPDATE/DELETE masivos sobre tablas del dashboard"""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if any(mapper.class_ in _DASHBOARD_MODELS for mapper in orm_execute_state.all_mappers):
+        orm_execute_state.session.info["dashboard_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_dashboard_on_commit(session):
+    if session.info.pop("dashboard_dirty", False):
+        invalidate_dashboard_cache()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_dashboard_changes(session):
+    session.info.pop("dashboard_dirty", None)
 
 
 class ReportService:
@@ -26,36 +69,76 @@ class ReportService:
     def __init__(self, db: Session):
         self.db = db
     
-    def get_dashboard_stats(self) -> Dict[str, Any]:
-        """Obtener estadísticas generales del dashboard"""
-        total_companies = self.db.query(Company).filter(Company.is_active == True).count()
-        total_users = self.db.query(User).filter(User.is_active == True).count()
-        total_questions = self.db.query(Question).filter(Question.is_active == True).count()
-        
-        active_questionnaires = self.db.query(QuestionnaireAssignment).filter(
+    def get_dashboard_stats(self, company_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Obtener estadísticas generales del dashboard
+        
+        Todos los conteos se resuelven en una sola sentencia y el resultado se
+        guarda en una caché en memoria de TTL corto, que además se invalida al
+        confirmar cambios en las tablas involucradas.
+        
+        Args:
+            company_id: Limitar las estadísticas a una empresa (None = global)
+        """
+        cached = _dashboard_cache.get(company_id)
+        if cached is not None:
+            return dict(cached)
+        
+        companies = self.db.query(func.count(Company.id)).filter(Company.is_active == True)
+        users = self.db.query(func.count(User.id)).filter(User.is_active == True)
+        questions = self.db.query(func.count(Question.id)).filter(Question.is_active == True)
+        questionnaires = self.db.query(func.count(QuestionnaireAssignment.id)).filter(
             QuestionnaireAssignment.is_active == True
-        ).count()
-        
-        total_assignments = self.db.query(QuestionAssignment).count()
-        completed_responses = self.db.query(Response).count()
+        )
+        assignments = self.db.query(func.count(QuestionAssignment.id))
+        responses = self.db.query(func.count(Response.id))
+        alerts = self.db.query(func.count(DivergenceAlert.id)).filter(DivergenceAlert.is_resolved == False)
+        
+        if company_id:
+            companies = companies.filter(Company.id == company_id)
+            users = users.join(Area, User.area_id == Area.id).filter(Area.company_id == company_id)
+            questionnaires = questionnaires.filter(QuestionnaireAssignment.company_id == company_id)
+            assignments = assignments.join(
+                QuestionnaireAssignment, QuestionAssignment.questionnaire_id == QuestionnaireAssignment.id
+            ).filter(QuestionnaireAssignment.company_id == company_id)
+            responses = responses.join(
+                QuestionAssignment, Response.assignment_id == QuestionAssignment.id
+            ).join(
+                QuestionnaireAssignment, QuestionAssignment.questionnaire_id == QuestionnaireAssignment.id
+            ).filter(QuestionnaireAssignment.company_id == company_id)
+            alerts = alerts.join(
+                QuestionnaireAssignment, DivergenceAlert.questionnaire_id == QuestionnaireAssignment.id
+            ).filter(QuestionnaireAssignment.company_id == company_id)
+        
+        counts = self.db.query(
+            companies.scalar_subquery().label("total_companies"),
+            users.scalar_subquery().label("total_users"),
+            questions.scalar_subquery().label("total_questions"),
+            questionnaires.scalar_subquery().label("active_questionnaires"),
+            assignments.scalar_subquery().label("total_assignments"),
+            responses.scalar_subquery().label("completed_responses"),
+            alerts.scalar_subquery().label("divergence_alerts")
+        ).one()
+        
+        total_assignments = counts.total_assignments or 0
+        completed_responses = counts.completed_responses or 0
         pending_responses = total_assignments - completed_responses
         
-        divergence_alerts = self.db.query(DivergenceAlert).filter(
-            DivergenceAlert.is_resolved == False
-        ).count()
-        
         completion_rate = (completed_responses / total_assignments * 100) if total_assignments > 0 else 0
         
-        return {
-            "total_companies": total_companies,
-            "total_users": total_users,
-            "total_questions": total_questions,
-            "active_questionnaires": active_questionnaires,
+        stats = {
+            "total_companies": counts.total_companies or 0,
+            "total_users": counts.total_users or 0,
+            "total_questions": counts.total_questions or 0,
+            "active_questionnaires": counts.active_questionnaires or 0,
             "pending_responses": pending_responses,
             "completed_responses": completed_responses,
-            "divergence_alerts": divergence_alerts,
+            "divergence_alerts": counts.divergence_alerts or 0,
             "completion_rate": round(completion_rate, 2)
         }
+        
+        _dashboard_cache.set(company_id, stats)
+        return dict(stats)
     
     def get_company_report(self, company_id: int, questionnaire_id: Optional[int] = None) -> Dict[str, Any]:
         """Generar reporte completo para una empresa"""
@@ -187,67 +270,71 @@ class ReportService:
             "divergence_alerts": divergence_alerts
         }
     
-    def export_to_excel(self, company_id: int, questionnaire_id: Optional[int] = None) -> BytesIO:
-        """Exportar datos a Excel"""
-        wb = Workbook()
-        
-        # Estilos
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="1E3A5F", end_color="1E3A5F", fill_type="solid")
-        centered = Alignment(horizontal="center", vertical="center")
-        border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
+    def export_to_excel(
+        self,
+        company_id: int,
+        output: Union[str, BinaryIO],
+        questionnaire_id: Optional[int] = None
+    ) -> None:
+        """
+        Exportar datos a Excel
+        
+        Usa el modo write-only de openpyxl (las filas se vuelcan a disco a medida
+        que se agregan), estilos con nombre compartidos entre celdas y lectura de
+        respuestas por lotes, de modo que la memoria no crece con la cantidad de
+        respuestas.
+        
+        Args:
+            output: Ruta o archivo binario donde escribir el .xlsx
+        """
+        wb = Workbook(write_only=True)
+        for style in _export_styles():
+            wb.add_named_style(style)
         
         # Obtener datos
         company = self.db.query(Company).filter(Company.id == company_id).first()
+        report = self.get_company_report(company_id, questionnaire_id)
         
         # Hoja 1: Resumen
-        ws_summary = wb.active
-        ws_summary.title = "Resumen"
+        ws_summary = wb.create_sheet("Resumen")
         
-        ws_summary["A1"] = "REPORTE DE CUMPLIMIENTO"
-        ws_summary["A1"].font = Font(bold=True, size=16)
-        ws_summary["A2"] = f"Empresa: {company.name}"
-        ws_summary["A3"] = f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
-        
-        report = self.get_company_report(company_id, questionnaire_id)
+        # Ajustar anchos (en modo write-only deben definirse antes de escribir filas)
+        for col in range(1, 7):
+            ws_summary.column_dimensions[chr(64 + col)].width = 15
         
-        ws_summary["A5"] = "PUNTAJE GENERAL"
-        ws_summary["A5"].font = Font(bold=True)
-        ws_summary["A6"] = f"{report['overall_percentage']}%"
-        ws_summary["A6"].font = Font(size=24, bold=True)
+        ws_summary.append([_cell(ws_summary, "REPORTE DE CUMPLIMIENTO", "cg_title")])
+        ws_summary.append([f"Empresa: {company.name}"])
+        ws_summary.append([f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}"])
+        ws_summary.append([None])
+        ws_summary.append([_cell(ws_summary, "PUNTAJE GENERAL", "cg_bold")])
+        ws_summary.append([_cell(ws_summary, f"{report['overall_percentage']}%", "cg_score")])
+        ws_summary.append([None])
         
         # Tabla de áreas
-        ws_summary["A8"] = "Cumplimiento por Área"
-        ws_summary["A8"].font = Font(bold=True)
+        ws_summary.append([_cell(ws_summary, "Cumplimiento por Área", "cg_bold")])
         
         headers = ["Área", "Puntaje", "Máximo", "Porcentaje", "Respondidas", "Total"]
-        for col, header in enumerate(headers, 1):
-            cell = ws_summary.cell(row=9, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = centered
-            cell.border = border
-        
-        for row, area in enumerate(report["areas_scores"], 10):
-            ws_summary.cell(row=row, column=1, value=area["area_name"]).border = border
-            ws_summary.cell(row=row, column=2, value=area["score"]).border = border
-            ws_summary.cell(row=row, column=3, value=area["max_score"]).border = border
-            ws_summary.cell(row=row, column=4, value=f"{area['percentage']}%").border = border
-            ws_summary.cell(row=row, column=5, value=area["questions_answered"]).border = border
-            ws_summary.cell(row=row, column=6, value=area["total_questions"]).border = border
-        
-        # Ajustar anchos
-        for col in range(1, 7):
-            ws_summary.column_dimensions[chr(64 + col)].width = 15
+        ws_summary.append([_cell(ws_summary, header, "cg_header") for header in headers])
+        
+        for area in report["areas_scores"]:
+            ws_summary.append([
+                _cell(ws_summary, value)
+                for value in (
+                    area["area_name"],
+                    area["score"],
+                    area["max_score"],
+                    f"{area['percentage']}%",
+                    area["questions_answered"],
+                    area["total_questions"]
+                )
+            ])
         
         # Hoja 2: Respuestas detalladas
         ws_responses = wb.create_sheet("Respuestas")
         
+        for column, width in zip("ABCDEFGHIJ", (20, 25, 15, 15, 10, 50, 15, 30, 10, 18)):
+            ws_responses.column_dimensions[column].width = width
+        
         # Query de todas las respuestas
         responses_query = self.db.query(
             User.full_name.label("user_name"),
@@ -281,87 +368,118 @@ class ReportService:
         
         # Headers
         response_headers = ["Usuario", "Email", "Área", "Categoría", "Código", "Pregunta", "Tipo", "Respuesta", "Puntaje", "Fecha"]
-        for col, header in enumerate(response_headers, 1):
-            cell = ws_responses.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = centered
-            cell.border = border
-        
-        for row, resp in enumerate(responses_query.all(), 2):
+        ws_responses.append([_cell(ws_responses, header, "cg_header") for header in response_headers])
+        
+        for resp in responses_query.order_by(QuestionAssignment.id).yield_per(EXPORT_BATCH_SIZE):
             answer_str = json.dumps(resp.answer) if isinstance(resp.answer, (dict, list)) else str(resp.answer)
             
-            ws_responses.cell(row=row, column=1, value=resp.user_name).border = border
-            ws_responses.cell(row=row, column=2, value=resp.user_email).border = border
-            ws_responses.cell(row=row, column=3, value=resp.area_name).border = border
-            ws_responses.cell(row=row, column=4, value=resp.category_name or "").border = border
-            ws_responses.cell(row=row, column=5, value=resp.question_code or "").border = border
-            ws_responses.cell(row=row, column=6, value=resp.question_text).border = border
-            ws_responses.cell(row=row, column=7, value=resp.question_type.value).border = border
-            ws_responses.cell(row=row, column=8, value=answer_str).border = border
-            ws_responses.cell(row=row, column=9, value=resp.score or 0).border = border
-            ws_responses.cell(row=row, column=10, value=resp.answered_at.strftime('%d/%m/%Y %H:%M') if resp.answered_at else "").border = border
-        
-        # Ajustar anchos
-        ws_responses.column_dimensions['A'].width = 20
-        ws_responses.column_dimensions['B'].width = 25
-        ws_responses.column_dimensions['C'].width = 15
-        ws_responses.column_dimensions['D'].width = 15
-        ws_responses.column_dimensions['E'].width = 10
-        ws_responses.column_dimensions['F'].width = 50
-        ws_responses.column_dimensions['G'].width = 15
-        ws_responses.column_dimensions['H'].width = 30
-        ws_responses.column_dimensions['I'].width = 10
-        ws_responses.column_dimensions['J'].width = 18
+            ws_responses.append([
+                _cell(ws_responses, value)
+                for value in (
+                    resp.user_name,
+                    resp.user_email,
+                    resp.area_name,
+                    resp.category_name or "",
+                    resp.question_code or "",
+                    resp.question_text,
+                    resp.question_type.value,
+                    answer_str,
+                    resp.score or 0,
+                    resp.answered_at.strftime('%d/%m/%Y %H:%M') if resp.answered_at else ""
+                )
+            ])
         
         # Hoja 3: Divergencias
         ws_divergence = wb.create_sheet("Divergencias")
         
+        for column, width in zip("ABCDEF", (50, 12, 30, 50, 12, 12)):
+            ws_divergence.column_dimensions[column].width = width
+        
         div_headers = ["Pregunta", "Severidad", "Usuarios Involucrados", "Respuestas", "Varianza", "Estado"]
-        for col, header in enumerate(div_headers, 1):
-            cell = ws_divergence.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = centered
-            cell.border = border
-        
-        for row, alert in enumerate(report["divergence_alerts"], 2):
+        ws_divergence.append([_cell(ws_divergence, header, "cg_header") for header in div_headers])
+        
+        for alert in report["divergence_alerts"]:
             users = ", ".join([r["user_name"] for r in alert["responses_data"]])
             responses = " | ".join([f"{r['user_name']}: {r['answer']}" for r in alert["responses_data"]])
             status = "Resuelto" if alert["is_resolved"] else "Pendiente"
             
-            # Color por severidad
-            severity_colors = {
-                "critical": "FF0000",
-                "high": "FF6B6B",
-                "medium": "FFB347",
-                "low": "77DD77"
-            }
-            severity_fill = PatternFill(
-                start_color=severity_colors.get(alert["severity"], "FFFFFF"),
-                end_color=severity_colors.get(alert["severity"], "FFFFFF"),
-                fill_type="solid"
-            )
-            
-            ws_divergence.cell(row=row, column=1, value=alert["question_text"]).border = border
-            cell_sev = ws_divergence.cell(row=row, column=2, value=alert["severity"].upper())
-            cell_sev.fill = severity_fill
-            cell_sev.border = border
-            ws_divergence.cell(row=row, column=3, value=users).border = border
-            ws_divergence.cell(row=row, column=4, value=responses).border = border
-            ws_divergence.cell(row=row, column=5, value=alert["variance"] or "N/A").border = border
-            ws_divergence.cell(row=row, column=6, value=status).border = border
-        
-        ws_divergence.column_dimensions['A'].width = 50
-        ws_divergence.column_dimensions['B'].width = 12
-        ws_divergence.column_dimensions['C'].width = 30
-        ws_divergence.column_dimensions['D'].width = 50
-        ws_divergence.column_dimensions['E'].width = 12
-        ws_divergence.column_dimensions['F'].width = 12
-        
-        # Guardar en BytesIO
-        output = BytesIO()
-        wb.save(output)
-        output.seek(0)
+            ws_divergence.append([
+                _cell(ws_divergence, alert["question_text"]),
+                _cell(ws_divergence, alert["severity"].upper(), f"cg_severity_{alert['severity']}"),
+                _cell(ws_divergence, users),
+                _cell(ws_divergence, responses),
+                _cell(ws_divergence, alert["variance"] or "N/A"),
+                _cell(ws_divergence, status)
+            ])
         
-        return output
+        wb.save(output)
+
+
+# ============================================================================
+# EXPORTACIÓN - ESTILOS Y UTILIDADES
+# ============================================================================
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Color por severidad
+SEVERITY_COLORS = {
+    "critical": "FF0000",
+    "high": "FF6B6B",
+    "medium": "FFB347",
+    "low": "77DD77"
+}
+
+
+def _export_styles() -> List[NamedStyle]:
+    """Estilos con nombre compartidos por todas las celdas del reporte"""
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    
+    styles = [
+        NamedStyle(name="cg_title", font=Font(bold=True, size=16)),
+        NamedStyle(name="cg_bold", font=Font(bold=True)),
+        NamedStyle(name="cg_score", font=Font(size=24, bold=True)),
+        NamedStyle(
+            name="cg_header",
+            font=Font(bold=True, color="FFFFFF"),
+            fill=PatternFill(start_color="1E3A5F", end_color="1E3A5F", fill_type="solid"),
+            alignment=Alignment(horizontal="center", vertical="center"),
+            border=border
+        ),
+        NamedStyle(name="cg_cell", border=border)
+    ]
+    
+    for severity, color in SEVERITY_COLORS.items():
+        styles.append(NamedStyle(
+            name=f"cg_severity_{severity}",
+            fill=PatternFill(start_color=color, end_color=color, fill_type="solid"),
+            border=border
+        ))
+    
+    return styles
+
+
+def _cell(ws, value, style: str = "cg_cell") -> WriteOnlyCell:
+    """Celda write-only con un estilo con nombre"""
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def iter_file_chunks(filepath: str, chunk_size: int = EXPORT_CHUNK_SIZE, delete: bool = True) -> Iterator[bytes]:
+    """Leer un archivo por bloques (para StreamingResponse) y eliminarlo al terminar"""
+    try:
+        with open(filepath, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if delete:
+            os.remove(filepath)
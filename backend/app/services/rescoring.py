@@ -0,0 +1,103 @@
+"""
+Recálculo de Puntajes en Segundo Plano
+Cuando cambian las opciones, el puntaje máximo o el tipo de una pregunta, los
+Response.score guardados quedan desactualizados; este trabajo los recalcula
+por lotes con la misma lógica que el envío de encuestas
+"""
+import os
+import logging
+from typing import Dict, Any
+
+from sqlalchemy import func, update
+
+from ..database import SessionLocal
+from ..models import Question, QuestionAssignment, Response
+from .jobs import job_queue, Job
+from .scoring import QuestionScorer
+from .divergence import enqueue_divergence_recalculation
+
+logger = logging.getLogger(__name__)
+
+RESCORE_CHUNK_SIZE = int(os.getenv("RESCORE_CHUNK_SIZE", "2000"))
+
+# Campos de la pregunta que afectan el puntaje
+SCORING_FIELDS = ("options", "max_score", "question_type")
+
+
+def enqueue_rescore(question_id: int) -> Job:
+    """Encolar el recálculo de puntajes de una pregunta (se combina con uno pendiente)"""
+    return job_queue.enqueue("rescore", question_id)
+
+
+@job_queue.handler("rescore")
+def run_rescore_job(job: Job) -> Dict[str, Any]:
+    """
+    Recalcular los puntajes de todas las respuestas de una pregunta
+    
+    Recorre las respuestas por id en lotes de RESCORE_CHUNK_SIZE, escribe solo
+    los puntajes que cambiaron con un UPDATE masivo y confirma cada lote por
+    separado para no mantener la base bloqueada. Al final encola el recálculo
+    de divergencias de los cuestionarios afectados.
+    """
+    db = SessionLocal()
+    try:
+        question = db.query(Question).filter(Question.id == job.key).first()
+        if not question:
+            return {"processed": 0, "updated": 0, "questionnaires": []}
+        
+        scorer = QuestionScorer(question)
+        
+        base_query = db.query(Response).join(
+            QuestionAssignment, Response.assignment_id == QuestionAssignment.id
+        ).filter(QuestionAssignment.question_id == question.id)
+        
+        total = base_query.with_entities(func.count(Response.id)).scalar()
+        job.set_progress(0, total)
+        
+        processed = 0
+        updated = 0
+        questionnaire_ids = set()
+        last_id = 0
+        
+        while True:
+            chunk = base_query.with_entities(
+                Response.id,
+                Response.answer,
+                Response.score,
+                QuestionAssignment.questionnaire_id
+            ).filter(
+                Response.id > last_id
+            ).order_by(Response.id).limit(RESCORE_CHUNK_SIZE).all()
+            
+            if not chunk:
+                break
+            
+            scores = scorer.score_many([row.answer for row in chunk])
+            changes = []
+            for row, score in zip(chunk, scores):
+                if row.score != score:
+                    changes.append({"id": row.id, "score": score})
+                    questionnaire_ids.add(row.questionnaire_id)
+            
+            if changes:
+                db.execute(update(Response), changes)
+                db.commit()
+            
+            processed += len(chunk)
+            updated += len(changes)
+            last_id = chunk[-1].id
+            job.set_progress(processed, max(total, processed))
+        
+        # Las divergencias de opción única dependen del puntaje
+        for questionnaire_id in questionnaire_ids:
+            enqueue_divergence_recalculation(questionnaire_id)
+        
+        logger.info(f"Pregunta {question.id}: {updated} de {processed} puntajes recalculados")
+        
+        return {
+            "processed": processed,
+            "updated": updated,
+            "questionnaires": sorted(questionnaire_ids)
+        }
+    finally:
+        db.close()
@@ -0,0 +1,96 @@
+"""
+Puntaje Precompilado por Pregunta
+Convierte las opciones de una pregunta en tablas de búsqueda para calcular
+puntajes sin recorrer question.options en cada respuesta
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from ..models import Question
+
+# Respuestas afirmativas para preguntas sí/no
+YES_ANSWERS = frozenset(["yes", "sí", "si", "true", "1"])
+
+
+class QuestionScorer:
+    """
+    Calculador de puntaje compilado para una versión de una pregunta
+    
+    Produce exactamente el mismo resultado que el cálculo original:
+    - yes_no: max_score si la respuesta es afirmativa
+    - single_choice: puntaje de la primera opción cuyo valor coincide (como texto)
+    - multiple_choice: suma de los puntajes de las opciones seleccionadas
+    - scale: proporcional al valor sobre una escala 1-5 o 1-10
+    - text: max_score si hay respuesta no vacía
+    """
+    
+    __slots__ = ("question_type", "max_score", "_score")
+    
+    def __init__(self, question: Question):
+        self.question_type = question.question_type.value
+        self.max_score = question.max_score
+        self._score: Callable[[Any], Any] = self._compile(question)
+    
+    def __call__(self, answer) -> float:
+        if answer is None:
+            return 0
+        return self._score(answer)
+    
+    def score_many(self, answers: Sequence[Any]) -> List[float]:
+        """Puntuar un lote de respuestas de esta pregunta"""
+        score = self._score
+        return [0 if answer is None else score(answer) for answer in answers]
+    
+    def _compile(self, question: Question) -> Callable[[Any], Any]:
+        max_score = self.max_score
+        options = question.options or []
+        
+        if self.question_type == "yes_no":
+            return lambda answer: max_score if str(answer).lower() in YES_ANSWERS else 0
+        
+        if self.question_type == "single_choice":
+            table: Dict[str, Any] = {}
+            for opt in options:
+                table.setdefault(str(opt.get("value")), opt.get("score", 0))
+            return lambda answer: table.get(str(answer), 0)
+        
+        if self.question_type == "multiple_choice":
+            # Se conserva el orden de las opciones para sumar igual que antes
+            pairs = [(opt.get("value"), opt.get("score", 0)) for opt in options]
+            return lambda answer: _score_multiple(pairs, answer)
+        
+        if self.question_type == "scale":
+            max_scale = _scale_max(max_score)
+            if max_scale is None:
+                return lambda answer: 0
+            return lambda answer: _score_scale(answer, max_scale, max_score)
+        
+        if self.question_type == "text":
+            return lambda answer: max_score if answer and str(answer).strip() else 0
+        
+        return lambda answer: 0
+
+
+def _scale_max(max_score: Optional[float]) -> Optional[int]:
+    """Tope de la escala (1-5 o 1-10) según el puntaje máximo"""
+    try:
+        return 10 if max_score > 50 else 5
+    except TypeError:
+        return None
+
+
+def _score_scale(answer, max_scale: int, max_score: float) -> float:
+    try:
+        return (float(answer) / max_scale) * max_score
+    except (ValueError, TypeError):
+        return 0
+
+
+def _score_multiple(pairs, answer) -> float:
+    if not pairs or not isinstance(answer, list):
+        return 0
+    try:
+        selected = set(answer)
+    except TypeError:
+        # Valores no hashables: comparar contra la lista
+        selected = answer
+    return sum(score for value, score in pairs if value in selected)
@@ -0,0 +1,78 @@
+"""
+Caché de Estado de Tokens
+Guarda en memoria el estado público de cada token (lo que consulta el
+frontend al sondear /public/survey/{token}/status) para no ir a la BD en
+cada consulta
+"""
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from ..models import AccessToken
+from ..utils.cache import TTLCache
+
+TOKEN_STATUS_CACHE_TTL = float(os.getenv("TOKEN_STATUS_CACHE_TTL", "30"))
+TOKEN_STATUS_CACHE_SIZE = int(os.getenv("TOKEN_STATUS_CACHE_SIZE", "20000"))
+
+
+def _isoformat(value) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+class TokenStatusCache:
+    """
+    Caché en proceso del estado de tokens, indexada por token_hash
+    
+    Los cambios hechos en este proceso (apertura, envío de respuestas,
+    envío de correos) invalidan la entrada; los de otros procesos se
+    reflejan al expirar el TTL. Los tokens inexistentes no se guardan, para
+    que consultas con tokens inventados no desplacen a los válidos.
+    """
+    
+    def __init__(self, ttl: float = TOKEN_STATUS_CACHE_TTL, maxsize: int = TOKEN_STATUS_CACHE_SIZE):
+        self._cache = TTLCache(ttl=ttl, maxsize=maxsize)
+    
+    def get(self, db: Session, token_hash: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Obtener el estado de un token
+        
+        Returns:
+            Dict con status y fechas de envío/apertura/término/expiración, o None si no existe
+        """
+        snapshot = self._cache.get(token_hash)
+        if snapshot is not None:
+            return snapshot
+        
+        row = db.query(
+            AccessToken.status,
+            AccessToken.sent_at,
+            AccessToken.opened_at,
+            AccessToken.completed_at,
+            AccessToken.expires_at
+        ).filter(AccessToken.token_hash == token_hash).first()
+        
+        if row is None:
+            return None
+        
+        snapshot = {
+            "status": row.status.value,
+            "sent_at": _isoformat(row.sent_at),
+            "opened_at": _isoformat(row.opened_at),
+            "completed_at": _isoformat(row.completed_at),
+            "expires_at": _isoformat(row.expires_at)
+        }
+        self._cache.set(token_hash, snapshot)
+        return snapshot
+    
+    def invalidate(self, token_hashes: Iterable[bytes]) -> None:
+        """Descartar tokens cuyo estado cambió"""
+        for token_hash in token_hashes:
+            self._cache.pop(token_hash)
+    
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+# Caché compartida por la aplicación
+token_status_cache = TokenStatusCache()
@@ -2,6 +2,8 @@
 from .security import (
     verify_password,
     get_password_hash,
+    verify_password_async,
+    get_password_hash_async,
     create_access_token,
     decode_token,
     generate_unique_token,
@@ -0,0 +1,65 @@
+"""
+Caché en Memoria con Expiración (TTL) y Límite LRU
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, List, Tuple
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Caché thread-safe con expiración por entrada y descarte LRU al superar maxsize"""
+    
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Obtener valor vigente (o default si no existe o expiró)"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Guardar valor (ttl opcional para esta entrada)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key: Hashable) -> None:
+        """Invalidar una entrada"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self) -> None:
+        """Invalidar todas las entradas"""
+        with self._lock:
+            self._data.clear()
+    
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Copia de las entradas vigentes"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (expires_at, value) in self._data.items()
+                if expires_at > now
+            ]
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
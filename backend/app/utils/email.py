@@ -2,10 +2,14 @@
 Servicio de Envío de Emails
 """
 import os
+import base64
 import smtplib
+from functools import lru_cache
+from string import Template
+from email.header import Header
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Optional, List
+from typing import Optional
 from datetime import datetime
 import logging
 
@@ -24,9 +28,19 @@ DEFAULT_SMTP_FROM_NAME = os.getenv("SMTP_FROM_NAME", "CyberGAP")
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8080")
 
+# Conexiones SMTP (el envío masivo reutiliza conexiones, ver utils.mailer)
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+
 
 class EmailService:
-    """Servicio para envío de correos electrónicos"""
+    """
+    Servicio para envío de correos electrónicos
+    
+    send_email abre una conexión por correo; los envíos por lote (una conexión
+    reutilizada por worker y reconexión si el servidor la corta) los hace
+    utils.mailer.AsyncMailer con los mensajes de build_message.
+    """
     
     def __init__(self, smtp_config: Optional[SMTPConfig] = None):
         """
@@ -59,9 +73,9 @@ class EmailService:
     def _get_connection(self):
         """Obtener conexión SMTP"""
         if self.use_ssl:
-            server = smtplib.SMTP_SSL(self.host, self.port)
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
         else:
-            server = smtplib.SMTP(self.host, self.port)
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
             if self.use_tls:
                 server.starttls()
         
@@ -70,6 +84,33 @@ class EmailService:
         
         return server
     
+    def build_message(
+        self,
+        to_email: str,
+        subject: str,
+        html_content: str,
+        text_content: Optional[str] = None
+    ) -> MIMEMultipart:
+        """Armar el mensaje MIME (texto plano opcional + HTML)"""
+        msg = MIMEMultipart("alternative")
+        msg["Subject"] = subject
+        msg["From"] = f"{self.from_name} <{self.from_email}>"
+        msg["To"] = to_email
+        
+        if self.reply_to:
+            msg["Reply-To"] = self.reply_to
+        
+        # Versión texto plano
+        if text_content:
+            part1 = MIMEText(text_content, "plain")
+            msg.attach(part1)
+        
+        # Versión HTML
+        part2 = MIMEText(html_content, "html")
+        msg.attach(part2)
+        
+        return msg
+    
     def send_email(
         self,
         to_email: str,
@@ -84,26 +125,10 @@ class EmailService:
             bool: True si se envió correctamente
         """
         try:
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = subject
-            msg["From"] = f"{self.from_name} <{self.from_email}>"
-            msg["To"] = to_email
+            msg = self.build_message(to_email, subject, html_content, text_content)
             
-            if self.reply_to:
-                msg["Reply-To"] = self.reply_to
-            
-            # Versión texto plano
-            if text_content:
-                part1 = MIMEText(text_content, "plain")
-                msg.attach(part1)
-            
-            # Versión HTML
-            part2 = MIMEText(html_content, "html")
-            msg.attach(part2)
-            
-            # Enviar
             with self._get_connection() as server:
-                server.sendmail(self.from_email, to_email, msg.as_string())
+                server.sendmail(self.from_email, to_email, msg.as_bytes())
             
             logger.info(f"Email enviado a {to_email}")
             return True
@@ -127,22 +152,14 @@ class EmailService:
             return False, str(e)
 
 
-def get_questionnaire_email_template(
+def _questionnaire_template(
     user_name: str,
     company_name: str,
     questionnaire_name: str,
-    token: str,
-    deadline: Optional[datetime] = None
+    link: str,
+    deadline_text: str
 ) -> tuple[str, str]:
-    """
-    Generar template de email para cuestionario
-    
-    Returns:
-        tuple: (html_content, text_content)
-    """
-    link = f"{BASE_URL}/survey/{token}"
-    deadline_text = deadline.strftime("%d/%m/%Y %H:%M") if deadline else "Sin fecha límite"
-    
+    """HTML y texto del correo de cuestionario"""
     html_content = f"""
     <!DOCTYPE html>
     <html>
@@ -225,17 +242,14 @@ def get_questionnaire_email_template(
     return html_content, text_content
 
 
-def get_reminder_email_template(
+def _reminder_template(
     user_name: str,
     company_name: str,
     questionnaire_name: str,
-    token: str,
-    deadline: Optional[datetime] = None
+    link: str,
+    deadline_text: str
 ) -> tuple[str, str]:
-    """Generar template de recordatorio"""
-    link = f"{BASE_URL}/survey/{token}"
-    deadline_text = deadline.strftime("%d/%m/%Y %H:%M") if deadline else "Sin fecha límite"
-    
+    """HTML y texto del correo de recordatorio"""
     html_content = f"""
     <!DOCTYPE html>
     <html>
@@ -292,3 +306,165 @@ def get_reminder_email_template(
     """
     
     return html_content, text_content
+
+
+# ============================================================================
+# PLANTILLAS PRE-RENDERADAS
+# ============================================================================
+
+_TEMPLATE_BUILDERS = {
+    "questionnaire": _questionnaire_template,
+    "reminder": _reminder_template
+}
+
+
+class EmailTemplate:
+    """
+    Plantilla con todo lo común de una campaña ya renderizado
+    
+    Solo quedan por reemplazar el nombre del destinatario y su enlace.
+    """
+    
+    __slots__ = ("html", "text")
+    
+    def __init__(self, html_content: str, text_content: str):
+        self.html = Template(html_content)
+        self.text = Template(text_content)
+    
+    def render(self, user_name: str, token: str) -> tuple[str, str]:
+        """
+        Completar la plantilla para un destinatario
+        
+        Returns:
+            tuple: (html_content, text_content)
+        """
+        values = {"user_name": user_name, "link": f"{BASE_URL}/survey/{token}"}
+        return self.html.substitute(values), self.text.substitute(values)
+
+
+@lru_cache(maxsize=256)
+def get_email_template(
+    kind: str,
+    company_name: str,
+    questionnaire_name: str,
+    deadline: Optional[datetime] = None
+) -> EmailTemplate:
+    """
+    Obtener (o renderizar una vez) la plantilla de una campaña
+    
+    Args:
+        kind: "questionnaire" o "reminder"
+    """
+    deadline_text = deadline.strftime("%d/%m/%Y %H:%M") if deadline else "Sin fecha límite"
+    html_content, text_content = _TEMPLATE_BUILDERS[kind](
+        user_name="${user_name}",
+        company_name=_escape_template(company_name),
+        questionnaire_name=_escape_template(questionnaire_name),
+        link="${link}",
+        deadline_text=deadline_text
+    )
+    return EmailTemplate(html_content, text_content)
+
+
+def _escape_template(value: str) -> str:
+    """Escapar "$" en los textos fijos para que string.Template no los interprete"""
+    return value.replace("$", "$$")
+
+
+def get_questionnaire_email_template(
+    user_name: str,
+    company_name: str,
+    questionnaire_name: str,
+    token: str,
+    deadline: Optional[datetime] = None
+) -> tuple[str, str]:
+    """
+    Generar template de email para cuestionario
+    
+    Returns:
+        tuple: (html_content, text_content)
+    """
+    return get_email_template("questionnaire", company_name, questionnaire_name, deadline).render(user_name, token)
+
+
+def get_reminder_email_template(
+    user_name: str,
+    company_name: str,
+    questionnaire_name: str,
+    token: str,
+    deadline: Optional[datetime] = None
+) -> tuple[str, str]:
+    """Generar template de recordatorio"""
+    return get_email_template("reminder", company_name, questionnaire_name, deadline).render(user_name, token)
+
+
+class PreparedMessage:
+    """
+    Mensaje ya serializado, listo para enviar
+    
+    Expone lo mínimo de email.message.Message que usan los envíos:
+    el header To y as_bytes().
+    """
+    
+    __slots__ = ("to_email", "data")
+    
+    def __init__(self, to_email: str, data: bytes):
+        self.to_email = to_email
+        self.data = data
+    
+    def __getitem__(self, name: str) -> Optional[str]:
+        return self.to_email if name.lower() == "to" else None
+    
+    def as_bytes(self) -> bytes:
+        return self.data
+
+
+class MessagePrototype:
+    """
+    Estructura MIME de una campaña armada y serializada una sola vez
+    
+    Por destinatario solo se completa la plantilla, se codifican en base64
+    los dos cuerpos y se insertan junto con el header To en el esqueleto.
+    """
+    
+    _MARKERS = ("@@CYBERGAP_TO@@", "@@CYBERGAP_TEXT@@", "@@CYBERGAP_HTML@@")
+    
+    def __init__(self, service: EmailService, subject: str, template: EmailTemplate):
+        self.template = template
+        
+        to_marker, text_marker, html_marker = self._MARKERS
+        msg = service.build_message(to_marker, subject, html_marker, text_marker)
+        
+        # Partes utf-8/base64 con el marcador como cuerpo (sin codificar)
+        parts = []
+        for subtype, marker in (("plain", text_marker), ("html", html_marker)):
+            part = MIMEText("", subtype, "utf-8")
+            part.set_payload(marker)
+            parts.append(part)
+        msg.set_payload(parts)
+        
+        skeleton = msg.as_string()
+        head, rest = skeleton.split(to_marker)
+        middle, rest = rest.split(text_marker)
+        between, tail = rest.split(html_marker)
+        self._chunks = (head, middle, between, tail)
+    
+    def render(self, to_email: str, user_name: str, token: str) -> PreparedMessage:
+        """Mensaje listo para enviar a un destinatario"""
+        html_content, text_content = self.template.render(user_name, token)
+        head, middle, between, tail = self._chunks
+        
+        # Direcciones no ASCII: header codificado como lo haría build_message
+        to_header = to_email if to_email.isascii() else Header(to_email, "utf-8").encode()
+        data = "".join((
+            head, to_header,
+            middle, _base64_body(text_content),
+            between, _base64_body(html_content),
+            tail
+        ))
+        return PreparedMessage(to_email, data.encode("ascii"))
+
+
+def _base64_body(content: str) -> str:
+    """Cuerpo utf-8 en base64 con líneas de 76 caracteres (igual que MIMEText)"""
+    return base64.encodebytes(content.encode("utf-8")).decode("ascii")
@@ -0,0 +1,281 @@
+"""
+Envío Asíncrono de Correos (aiosmtplib)
+Envía campañas sin bloquear el event loop, con concurrencia acotada por
+servidor SMTP, límite de velocidad por empresa y reintentos con backoff
+"""
+import os
+import asyncio
+import logging
+import weakref
+from datetime import datetime
+from email.message import Message
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import aiosmtplib
+
+from ..models import AccessToken, TokenStatus
+from .email import EmailService, SMTP_TIMEOUT, SMTP_MAX_MESSAGES_PER_CONNECTION
+
+logger = logging.getLogger(__name__)
+
+MAILER_CONCURRENCY_PER_HOST = int(os.getenv("MAILER_CONCURRENCY_PER_HOST", "5"))
+MAILER_RATE_PER_COMPANY = float(os.getenv("MAILER_RATE_PER_COMPANY", "10"))  # correos por segundo
+MAILER_MAX_ATTEMPTS = int(os.getenv("MAILER_MAX_ATTEMPTS", "3"))
+MAILER_RETRY_BACKOFF = float(os.getenv("MAILER_RETRY_BACKOFF", "1.0"))  # segundos (se duplica por intento)
+SMTP_QUIT_TIMEOUT = 2.0
+
+# Errores que justifican reintentar (conexión caída, timeout, respuestas 4xx)
+_TRANSIENT_ERRORS = (
+    aiosmtplib.SMTPServerDisconnected,
+    aiosmtplib.SMTPConnectError,
+    aiosmtplib.SMTPTimeoutError,
+    ConnectionError,
+    asyncio.TimeoutError
+)
+
+
+class MailResult:
+    """Resultado del envío a un destinatario"""
+    
+    __slots__ = ("key", "to_email", "success", "attempts", "error", "permanent")
+    
+    def __init__(self, key: Hashable, to_email: str):
+        self.key = key
+        self.to_email = to_email
+        self.success = False
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.permanent = False  # Rechazo definitivo (5xx): no tiene sentido reintentar
+
+
+class RateLimiter:
+    """Espaciado uniforme de envíos (rate por segundo)"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# Estado compartido por event loop: cupos de conexión por host y limitadores por empresa
+_loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Dict]]" = weakref.WeakKeyDictionary()
+
+
+def _shared_state() -> Dict[str, Dict]:
+    loop = asyncio.get_running_loop()
+    state = _loop_state.get(loop)
+    if state is None:
+        state = _loop_state[loop] = {"hosts": {}, "companies": {}}
+    return state
+
+
+def _host_slots(host: str, port: int) -> asyncio.Semaphore:
+    hosts = _shared_state()["hosts"]
+    key = (host, port)
+    if key not in hosts:
+        hosts[key] = asyncio.Semaphore(MAILER_CONCURRENCY_PER_HOST)
+    return hosts[key]
+
+
+def _company_limiter(company_id: Optional[int]) -> RateLimiter:
+    companies = _shared_state()["companies"]
+    if company_id not in companies:
+        companies[company_id] = RateLimiter(MAILER_RATE_PER_COMPANY)
+    return companies[company_id]
+
+
+class AsyncMailer:
+    """
+    Envío concurrente de una campaña
+    
+    Cada worker mantiene su propia conexión autenticada y ocupa uno de los
+    MAILER_CONCURRENCY_PER_HOST cupos del servidor SMTP (compartidos entre
+    campañas). Los errores transitorios se reintentan con backoff
+    exponencial; los rechazos definitivos (5xx) no.
+    """
+    
+    def __init__(
+        self,
+        email_service: EmailService,
+        company_id: Optional[int] = None,
+        max_attempts: int = MAILER_MAX_ATTEMPTS,
+        retry_backoff: float = MAILER_RETRY_BACKOFF
+    ):
+        self.service = email_service
+        self.company_id = company_id
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff = retry_backoff
+    
+    async def send_messages(self, messages: Sequence[Tuple[Hashable, Message]]) -> List[MailResult]:
+        """
+        Enviar mensajes concurrentemente
+        
+        Args:
+            messages: [(clave, mensaje)] con mensajes de EmailService.build_message o
+                      MessagePrototype.render; la clave identifica al destinatario en el resultado
+        
+        Returns:
+            List[MailResult]: Un resultado por mensaje, en el mismo orden
+        """
+        results = [MailResult(key, msg["To"]) for key, msg in messages]
+        if not messages:
+            return results
+        
+        queue: "asyncio.Queue[int]" = asyncio.Queue()
+        for i in range(len(messages)):
+            queue.put_nowait(i)
+        
+        slots = _host_slots(self.service.host, self.service.port)
+        limiter = _company_limiter(self.company_id)
+        workers = min(MAILER_CONCURRENCY_PER_HOST, len(messages))
+        state = {"unreachable": None}
+        
+        await asyncio.gather(*(
+            self._worker(queue, messages, results, slots, limiter, state)
+            for _ in range(workers)
+        ))
+        
+        sent = sum(1 for result in results if result.success)
+        logger.info(f"Campaña enviada por {self.service.host}: {sent}/{len(results)} correos")
+        return results
+    
+    async def _worker(self, queue, messages, results, slots: asyncio.Semaphore, limiter: RateLimiter, state: Dict) -> None:
+        async with slots:
+            smtp: Optional[aiosmtplib.SMTP] = None
+            sent_on_connection = 0
+            try:
+                while not queue.empty():
+                    i = queue.get_nowait()
+                    msg = messages[i][1]
+                    result = results[i]
+                    
+                    if state["unreachable"]:
+                        # El servidor no respondió tras todos los intentos: no insistir por cada mensaje
+                        result.error = state["unreachable"]
+                        continue
+                    
+                    connect_failed = False
+                    while result.attempts < self.max_attempts:
+                        result.attempts += 1
+                        await limiter.acquire()
+                        connect_failed = False
+                        try:
+                            if smtp is not None and sent_on_connection >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+                                await _quit(smtp)
+                                smtp = None
+                            if smtp is None:
+                                connect_failed = True
+                                smtp = await self._connect()
+                                connect_failed = False
+                                sent_on_connection = 0
+                            
+                            # Direcciones no ASCII solo viajan con SMTPUTF8
+                            mail_options = None if result.to_email.isascii() else ["SMTPUTF8"]
+                            await smtp.sendmail(
+                                self.service.from_email, [result.to_email], msg.as_bytes(),
+                                mail_options=mail_options
+                            )
+                            sent_on_connection += 1
+                            result.success = True
+                            result.error = None
+                            break
+                        except _TRANSIENT_ERRORS as e:
+                            result.error = str(e) or type(e).__name__
+                            smtp = await _discard(smtp)
+                        except aiosmtplib.SMTPRecipientsRefused as e:
+                            # La conexión sigue siendo válida (aiosmtplib hace RSET)
+                            result.error = "; ".join(f"{r.code} {r.message}" for r in e.recipients)
+                            if all(r.code >= 500 for r in e.recipients):
+                                result.permanent = True
+                                break  # Rechazo definitivo
+                        except aiosmtplib.SMTPResponseException as e:
+                            result.error = f"{e.code} {e.message}"
+                            smtp = await _discard(smtp)
+                            if e.code >= 500:
+                                result.permanent = True
+                                break  # Rechazo definitivo
+                        except aiosmtplib.SMTPNotSupported as e:
+                            # El servidor no admite la dirección (p. ej. sin SMTPUTF8); nada se envió
+                            result.error = str(e)
+                            result.permanent = True
+                            break
+                        except Exception as e:
+                            result.error = str(e) or type(e).__name__
+                            smtp = await _discard(smtp)
+                            break
+                        
+                        if result.attempts < self.max_attempts:
+                            await asyncio.sleep(self.retry_backoff * 2 ** (result.attempts - 1))
+                    
+                    if not result.success:
+                        logger.error(f"Error enviando email a {result.to_email}: {result.error}")
+                        if connect_failed:
+                            state["unreachable"] = result.error
+            finally:
+                if smtp is not None:
+                    await _quit(smtp)
+    
+    async def _connect(self) -> aiosmtplib.SMTP:
+        service = self.service
+        smtp = aiosmtplib.SMTP(
+            hostname=service.host,
+            port=service.port,
+            use_tls=service.use_ssl,
+            start_tls=bool(service.use_tls and not service.use_ssl),
+            timeout=SMTP_TIMEOUT
+        )
+        await smtp.connect()
+        if service.username and service.password:
+            await smtp.login(service.username, service.password)
+        return smtp
+
+
+async def _quit(smtp: aiosmtplib.SMTP) -> None:
+    """Cerrar ordenadamente (sin esperar si el servidor ya cortó la conexión)"""
+    if not smtp.is_connected:
+        smtp.close()
+        return
+    try:
+        await smtp.quit(timeout=SMTP_QUIT_TIMEOUT)
+    except Exception:
+        smtp.close()
+
+
+async def _discard(smtp: Optional[aiosmtplib.SMTP]) -> None:
+    """Cerrar una conexión en estado dudoso (se abre otra en el siguiente intento)"""
+    if smtp is not None:
+        smtp.close()
+    return None
+
+
+def record_send_result(
+    access_token: AccessToken,
+    result: MailResult,
+    attempted_at: datetime,
+    mark_sent: bool = True
+) -> None:
+    """
+    Registrar en el AccessToken el resultado del envío de su correo
+    
+    Args:
+        mark_sent: Pasar el token a SENT si se envió (False para recordatorios).
+            Solo avanza tokens PENDING: uno ya abierto o completado no retrocede
+    """
+    access_token.send_attempts = (access_token.send_attempts or 0) + result.attempts
+    access_token.last_send_attempt_at = attempted_at
+    access_token.last_send_error = result.error[:500] if result.error else None
+    
+    if result.success and mark_sent and access_token.status == TokenStatus.PENDING:
+        access_token.status = TokenStatus.SENT
+        access_token.sent_at = attempted_at
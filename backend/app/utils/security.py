@@ -2,9 +2,11 @@
 Utilidades de Seguridad - JWT, Hashing, Tokens
 """
 import os
+import asyncio
 import secrets
 import hashlib
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -15,6 +17,7 @@ from cryptography.fernet import Fernet
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "480"))  # 8 horas
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))  # bcrypt concurrentes
 
 # Encriptación para contraseñas SMTP
 def get_fernet_key():
@@ -54,6 +57,23 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# bcrypt tarda ~250 ms: desde código async se ejecuta en un pool acotado
+# para no bloquear el event loop ni saturar la CPU con logins simultáneos
+_password_executor = ThreadPoolExecutor(max_workers=max(1, PASSWORD_HASH_WORKERS), thread_name_prefix="password-hash")
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Crear token JWT"""
     to_encode = data.copy()
@@ -95,5 +115,10 @@ def hash_token(token: str) -> str:
     return hashlib.sha256(token.encode()).hexdigest()
 
 
+def token_digest(token: str) -> bytes:
+    """SHA-256 binario del token (clave de búsqueda de AccessToken.token_hash)"""
+    return hashlib.sha256(token.encode()).digest()
+
+
 # Alias para compatibilidad
 hash_password = get_password_hash
@@ -53,4 +53,6 @@ except Exception as e:
 
 echo ""
 echo "✅ Verificación completa. Iniciando servidor en puerto 8085..."
-exec uvicorn app.main:app --host 0.0.0.0 --port 8085
+# La IP real del cliente llega en X-Forwarded-For desde el proxy (nginx)
+exec uvicorn app.main:app --host 0.0.0.0 --port 8085 \
+    --proxy-headers --forwarded-allow-ips "${FORWARDED_ALLOW_IPS:-127.0.0.1}"
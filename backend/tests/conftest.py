@@ -0,0 +1,27 @@
+"""
+Fixtures compartidas: base SQLite temporal con el esquema completo
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Fábrica de sesiones sobre una base en archivo (cada sesión con su conexión, usable entre hilos)"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
@@ -0,0 +1,128 @@
+"""
+Autenticación de admins: caché de tokens verificados y límite de intentos de login
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import get_db
+from app.main import app
+from app.models import AdminUser
+from app.routers import auth
+from app.utils.security import create_access_token, get_password_hash
+
+
+@pytest.fixture
+def client(session_factory):
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+    
+    app.dependency_overrides[get_db] = override_get_db
+    auth._admin_cache.clear()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+    auth._admin_cache.clear()
+
+
+@pytest.fixture
+def admin(db):
+    admin = AdminUser(email="ana@example.com", hashed_password="x", full_name="Ana Admin")
+    db.add(admin)
+    db.commit()
+    return admin
+
+
+def _headers(email: str):
+    return {"Authorization": f"Bearer {create_access_token(data={'sub': email})}"}
+
+
+def test_cached_token_sees_deactivation(client, db, admin):
+    headers = _headers(admin.email)
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 200  # Desde caché
+    
+    admin.is_active = False
+    db.commit()
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+
+
+def test_cached_token_sees_deletion_and_email_change(client, db, admin):
+    headers = _headers(admin.email)
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    
+    admin.email = "ana.nueva@example.com"
+    db.commit()
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+    
+    headers = _headers(admin.email)
+    assert client.get("/api/auth/me", headers=headers).json()["email"] == "ana.nueva@example.com"
+    db.delete(admin)
+    db.commit()
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+
+
+# ----------------------------------------------------------------------
+# Límite de intentos de login
+# ----------------------------------------------------------------------
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    
+    def __call__(self):
+        return self.now
+
+
+def test_limiter_blocks_at_threshold_and_reopens_after_window(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(auth.time, "monotonic", clock)
+    limiter = auth.LoginRateLimiter(limit=3, window=60)
+    
+    for _ in range(2):
+        limiter.record_failure("ip|ana")
+        clock.now += 1
+    assert limiter.retry_after("ip|ana") is None
+    
+    limiter.record_failure("ip|ana")
+    assert limiter.retry_after("ip|ana") == 59  # El primer fallo vence en 58 s (redondeado hacia arriba)
+    assert limiter.retry_after("ip|otro") is None
+    
+    clock.now += 58.5  # Vence el primer fallo: quedan 2 en la ventana
+    assert limiter.retry_after("ip|ana") is None
+    
+    limiter.reset("ip|ana")
+    for _ in range(2):
+        limiter.record_failure("ip|ana")
+    assert limiter.retry_after("ip|ana") is None
+
+
+@pytest.fixture
+def limited_client(client, db, monkeypatch):
+    monkeypatch.setattr(auth, "login_rate_limiter", auth.LoginRateLimiter(limit=3, window=60))
+    db.add(AdminUser(email="bea@example.com", hashed_password=get_password_hash("secreta123"), full_name="Bea Admin"))
+    db.commit()
+    return client
+
+
+def _login(client, email, password):
+    return client.post("/api/auth/login", json={"email": email, "password": password})
+
+
+def test_login_lockout_is_per_email_and_cleared_by_success(limited_client, monkeypatch):
+    client = limited_client
+    assert [_login(client, "bea@example.com", "mala").status_code for _ in range(3)] == [401, 401, 401]
+    
+    blocked = _login(client, "bea@example.com", "secreta123")
+    assert blocked.status_code == 429
+    assert int(blocked.headers["Retry-After"]) > 0
+    assert _login(client, "otra@example.com", "mala").status_code == 401  # Otra clave, misma IP
+    
+    monkeypatch.setattr(auth, "login_rate_limiter", auth.LoginRateLimiter(limit=3, window=60))
+    for _ in range(2):
+        _login(client, "bea@example.com", "mala")
+    assert _login(client, "bea@example.com", "secreta123").status_code == 200
+    # El login exitoso limpia los fallos previos
+    assert [_login(client, "bea@example.com", "mala").status_code for _ in range(2)] == [401, 401]
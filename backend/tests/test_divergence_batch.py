@@ -0,0 +1,115 @@
+"""
+Paridad del analizador vectorizado con el análisis pregunta por pregunta
+"""
+import math
+import random
+from collections import defaultdict, namedtuple
+
+from app.services.divergence import DivergenceService
+from app.services.divergence_batch import BatchDivergenceAnalyzer
+
+Row = namedtuple("Row", "question_id user_id user_name area_name answer score question_type")
+
+OPTION_SCORES = {"a": 0, "b": 50, "c": 100, "d": 25}
+
+
+def _answer(rng: random.Random, question_type: str, spread: int):
+    """Respuesta aleatoria; spread acota la variedad para tener preguntas sin divergencia"""
+    options = "abcd"[:spread]
+    if question_type == "single_choice":
+        return rng.choice(options)
+    if question_type == "multiple_choice":
+        return rng.choice([
+            rng.sample(options, rng.randint(0, len(options))),
+            rng.choice(options),  # Valor suelto en vez de lista
+            []
+        ])
+    if question_type == "scale":
+        return rng.choice([None, rng.randint(1, 1 + spread * 3)])
+    if question_type == "yes_no":
+        return rng.choice(["yes", "no"][:max(1, spread - 1)])
+    return rng.choice(["Foo", "foo ", " FOO", "bar"][:spread])
+
+
+def _score(rng: random.Random, question_type: str, answer):
+    if rng.random() < 0.05:
+        return None
+    if question_type == "single_choice":
+        return OPTION_SCORES[answer]
+    if question_type == "multiple_choice":
+        values = answer if isinstance(answer, list) else [answer]
+        return float(sum(OPTION_SCORES[v] for v in values))
+    if question_type == "scale":
+        return None if answer is None else answer * 10.0
+    if question_type == "yes_no":
+        return 100.0 if answer == "yes" else 0.0
+    return 0.0
+
+
+def _corpus(seed: int = 20240501):
+    """Corpus fijo: 5 tipos x varias dispersiones, con preguntas de 1 a 40 respuestas"""
+    rng = random.Random(seed)
+    types = ["single_choice", "multiple_choice", "scale", "yes_no", "text"]
+    rows = []
+    question_id = 0
+    for question_type in types:
+        for spread in (1, 2, 3, 4):
+            for n_responses in (1, 2, 7, 40):
+                question_id += 1
+                for user_id in range(1, n_responses + 1):
+                    answer = _answer(rng, question_type, spread)
+                    rows.append(Row(
+                        question_id, user_id, f"Usuario {user_id}", f"Área {user_id % 3}",
+                        answer, _score(rng, question_type, answer), question_type
+                    ))
+    rng.shuffle(rows)
+    return rows
+
+
+def _reference(rows):
+    """Resultado de DivergenceService._analyze_divergence para cada pregunta con más de una respuesta"""
+    grouped = defaultdict(list)
+    question_types = {}
+    for row in rows:
+        grouped[row.question_id].append({
+            "user_id": row.user_id,
+            "user_name": row.user_name,
+            "area_name": row.area_name,
+            "answer": row.answer,
+            "score": row.score
+        })
+        question_types[row.question_id] = row.question_type
+    
+    service = DivergenceService(None)
+    return {
+        question_id: service._analyze_divergence({
+            "responses": responses,
+            "question_type": question_types[question_id],
+            "options": None
+        })
+        for question_id, responses in grouped.items()
+        if len(responses) > 1
+    }
+
+
+def test_batch_analyzer_matches_per_question_analysis():
+    rows = _corpus()
+    expected = _reference(rows)
+    result = BatchDivergenceAnalyzer(rows).analyze()
+    
+    assert result.keys() == expected.keys()
+    assert any(info["has_divergence"] for info in expected.values())
+    assert not all(info["has_divergence"] for info in expected.values())
+    
+    for question_id, reference in expected.items():
+        info = result[question_id]
+        assert info["has_divergence"] == reference["has_divergence"], question_id
+        assert info["severity"] == reference["severity"], question_id
+        
+        if reference["variance"] is None:
+            assert info["variance"] is None, question_id
+        else:
+            assert math.isclose(info["variance"], reference["variance"], rel_tol=1e-9, abs_tol=1e-12), question_id
+        
+        if reference["has_divergence"]:
+            assert info["responses"] == reference["responses"], question_id
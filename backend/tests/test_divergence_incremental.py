@@ -0,0 +1,92 @@
+"""
+Recálculo incremental de divergencias frente al recálculo completo
+"""
+import random
+
+from sqlalchemy import insert
+
+from app.models import (
+    Company, Area, User, Question, QuestionType, QuestionnaireAssignment,
+    QuestionAssignment, Response, DivergenceAlert
+)
+from app.services.divergence import DivergenceService
+
+# Escala que diverge (CV > 20%), converge y vuelve a divergir: las respuestas
+# que llegan mientras no diverge también deben quedar en la alerta
+SCALE_ANSWERS = [6, 10] + [8] * 15 + [2, 10, 2, 10, 2] + [8] * 15 + [1, 10, 1, 10]
+
+
+def _fixture(db):
+    company = Company(name="Acme")
+    db.add(company)
+    db.flush()
+    area = Area(company_id=company.id, name="TI")
+    db.add(area)
+    db.flush()
+    users = [User(area_id=area.id, email=f"u{i}@x.cl", full_name=f"Usuario {i}") for i in range(len(SCALE_ANSWERS))]
+    questions = [
+        Question(text="escala", question_type=QuestionType.SCALE, max_score=100),
+        Question(text="sí/no", question_type=QuestionType.YES_NO)
+    ]
+    questionnaire = QuestionnaireAssignment(company_id=company.id, name="Campaña")
+    db.add_all(users + questions + [questionnaire])
+    db.flush()
+    
+    assignments = {}
+    for user in users:
+        for question in questions:
+            assignment = QuestionAssignment(
+                questionnaire_id=questionnaire.id, question_id=question.id, user_id=user.id
+            )
+            db.add(assignment)
+            assignments[user.id, question.id] = assignment
+    db.commit()
+    return questionnaire.id, users, questions, assignments
+
+
+def _submit(db, service, questionnaire_id, items):
+    """Lo mismo que hace el envío público: respuestas + estadísticas + recálculo incremental"""
+    db.execute(insert(Response), [
+        {"assignment_id": item["assignment_id"], "answer": item["answer"], "score": item["score"]}
+        for item in items
+    ])
+    service.record_responses(questionnaire_id, items)
+    db.commit()
+    service.update_divergences_for_questions(
+        questionnaire_id,
+        {item["question_id"] for item in items},
+        [item["assignment_id"] for item in items]
+    )
+
+
+def test_incremental_alerts_match_full_recalculation(db):
+    questionnaire_id, users, (scale, yes_no), assignments = _fixture(db)
+    service = DivergenceService(db)
+    rng = random.Random(7)
+    
+    for i, (user, value) in enumerate(zip(users, SCALE_ANSWERS)):
+        answer = rng.choice(["yes", "no"]) if i % 3 else "yes"
+        _submit(db, service, questionnaire_id, [
+            {
+                "assignment_id": assignments[user.id, scale.id].id,
+                "question_id": scale.id,
+                "question_type": "scale",
+                "answer": value,
+                "score": value * 10.0
+            },
+            {
+                "assignment_id": assignments[user.id, yes_no.id].id,
+                "question_id": yes_no.id,
+                "question_type": "yes_no",
+                "answer": answer,
+                "score": 100.0 if answer == "yes" else 0.0
+            }
+        ])
+    
+    alerts = {alert.question_id: alert for alert in db.query(DivergenceAlert)}
+    assert alerts.keys() == {scale.id, yes_no.id}
+    for alert in alerts.values():
+        assert len(alert.responses_data) == len(users)
+    
+    result = service.calculate_divergences(questionnaire_id)
+    assert result == {"created": 0, "updated": 0, "unchanged": 2}
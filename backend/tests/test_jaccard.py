@@ -0,0 +1,54 @@
+"""
+Jaccard promedio por histograma frente a la referencia por pares
+"""
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from app.services.divergence import _average_jaccard, _pairwise_jaccard_reference
+
+OPTIONS = "abcdef"
+
+
+def _histogram(answers):
+    return Counter(frozenset(a) if isinstance(a, list) else frozenset([a]) for a in answers)
+
+
+def _assert_same(answers):
+    expected = _pairwise_jaccard_reference(answers)
+    result = _average_jaccard(_histogram(answers))
+    if expected is None:
+        assert result is None, answers
+    else:
+        assert math.isclose(result, expected, rel_tol=1e-12, abs_tol=1e-12), answers
+
+
+@pytest.mark.parametrize("answers", [
+    [],
+    [["a", "b"]],
+    [[]],
+    [[], []],
+    [[], [], ["a"]],
+    [["a", "b"], ["a", "b"], ["a", "b"]],
+    [["a"], ["b"]],
+    ["a", ["a"], ["a", "b"]],
+    [[], ["a"], ["a", "b", "c"], ["c"]],
+])
+def test_edge_cases_match_pairwise_reference(answers):
+    _assert_same(answers)
+
+
+def test_random_answer_sets_match_pairwise_reference():
+    rng = random.Random(1234)
+    for _ in range(300):
+        n_options = rng.randint(1, len(OPTIONS))
+        answers = [
+            rng.choice([
+                rng.sample(OPTIONS[:n_options], rng.randint(0, n_options)),
+                rng.choice(OPTIONS[:n_options])  # Valor suelto en vez de lista
+            ])
+            for _ in range(rng.randint(0, 30))
+        ]
+        _assert_same(answers)
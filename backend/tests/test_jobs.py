@@ -0,0 +1,98 @@
+"""
+Cola de trabajos: coalescencia, espera por (kind, key) y detención
+"""
+import threading
+import time
+
+import pytest
+
+from app.services.jobs import JobQueue, JobStatus
+
+
+def _wait_until(condition, timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condición no alcanzada"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def jobs():
+    queue = JobQueue(workers=2)
+    gates = {}
+    calls = []
+    
+    @queue.handler("work")
+    def work(job):
+        calls.append((job.key, dict(job.params)))
+        gate = gates.get(job.key)
+        if gate is not None:
+            assert gate.wait(5)
+        return job.params
+    
+    queue.gates = gates
+    queue.calls = calls
+    yield queue
+    for gate in gates.values():
+        gate.set()
+    queue.shutdown(timeout=5)
+
+
+def _merge(current, new):
+    return {"ids": current["ids"] | new["ids"]}
+
+
+def test_repeated_requests_coalesce_into_one_pending_job(jobs):
+    # Ocupar ambos workers para que los trabajos siguientes queden pendientes
+    for key in ("a", "b"):
+        jobs.gates[key] = threading.Event()
+        jobs.enqueue("work", key)
+    _wait_until(lambda: len(jobs.calls) == 2)
+    
+    first = jobs.enqueue("work", 1, {"ids": {1}}, merge=_merge)
+    second = jobs.enqueue("work", 1, {"ids": {2}}, merge=_merge)
+    assert second is first
+    assert first.requests == 2
+    assert first.params == {"ids": {1, 2}}
+    
+    jobs.gates["a"].set()
+    assert first.wait(2)
+    assert first.status == JobStatus.COMPLETED
+    assert [call for call in jobs.calls if call[0] == 1] == [(1, {"ids": {1, 2}})]
+
+
+def test_same_key_waits_for_running_job(jobs):
+    jobs.gates[1] = threading.Event()
+    running = jobs.enqueue("work", 1, {"n": 1})
+    _wait_until(lambda: running.status == JobStatus.RUNNING)
+    
+    waiting = jobs.enqueue("work", 1, {"n": 2})
+    _wait_until(lambda: ("work", 1) in jobs._deferred)
+    assert waiting.status == JobStatus.PENDING
+    
+    jobs.gates[1].set()
+    assert waiting.wait(2)
+    assert waiting.status == JobStatus.COMPLETED
+    assert waiting.started_at >= running.finished_at
+
+
+def test_shutdown_discards_deferred_and_new_jobs(jobs):
+    jobs.gates[1] = threading.Event()
+    running = jobs.enqueue("work", 1, {"n": 1})
+    _wait_until(lambda: running.status == JobStatus.RUNNING)
+    waiting = jobs.enqueue("work", 1, {"n": 2})
+    _wait_until(lambda: ("work", 1) in jobs._deferred)
+    
+    stopper = threading.Thread(target=jobs.shutdown)
+    stopper.start()
+    _wait_until(lambda: jobs._closed)
+    late = jobs.enqueue("work", 2)
+    jobs.gates[1].set()
+    stopper.join(5)
+    
+    assert running.status == JobStatus.COMPLETED
+    assert waiting.wait(2)
+    assert waiting.status == JobStatus.FAILED
+    assert late.status == JobStatus.FAILED
+    assert jobs.get(waiting.id) is waiting
+    assert not stopper.is_alive()
@@ -0,0 +1,116 @@
+"""
+AsyncMailer contra un servidor SMTP local de prueba
+"""
+import asyncio
+
+import pytest
+
+from app.utils import mailer
+from app.utils.email import EmailService
+from app.utils.mailer import AsyncMailer
+
+
+class StandInSMTP:
+    """
+    Servidor SMTP mínimo en el event loop del test
+    
+    Acepta todo y guarda (destinatario, conexión) por mensaje; con
+    drop_every corta la conexión tras esa cantidad de mensajes.
+    """
+    
+    def __init__(self, drop_every=None):
+        self.drop_every = drop_every
+        self.connections = 0
+        self.messages = []
+        self.port = None
+        self._server = None
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+    
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        connection = self.connections
+        delivered = 0
+        recipient = None
+        writer.write(b"220 stand-in ESMTP\r\n")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                writer.write(b"250-stand-in\r\n250 8BITMIME\r\n")
+            elif command.startswith("RCPT"):
+                recipient = line.decode().split(":", 1)[1].strip().strip("<>").lower()
+                writer.write(b"250 ok\r\n")
+            elif command == "DATA":
+                writer.write(b"354 go\r\n")
+                while await reader.readline() not in (b".\r\n", b""):
+                    pass
+                self.messages.append((recipient, connection))
+                delivered += 1
+                writer.write(b"250 queued\r\n")
+                if self.drop_every and delivered % self.drop_every == 0:
+                    await writer.drain()
+                    writer.close()
+                    return
+            elif command == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                writer.close()
+                return
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+
+def _send(server: StandInSMTP, n_messages: int):
+    async def run():
+        await server.start()
+        try:
+            service = EmailService()
+            service.host, service.port = "127.0.0.1", server.port
+            service.use_tls = service.use_ssl = False
+            service.username = service.password = ""
+            messages = [
+                (i, service.build_message(f"u{i}@x.cl", "Asunto", "<p>Hola</p>", "Hola"))
+                for i in range(n_messages)
+            ]
+            return await AsyncMailer(service, retry_backoff=0).send_messages(messages)
+        finally:
+            await server.stop()
+    
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def single_connection(monkeypatch):
+    """Un solo worker por servidor y sin límite de velocidad apreciable"""
+    monkeypatch.setattr(mailer, "MAILER_CONCURRENCY_PER_HOST", 1)
+    monkeypatch.setattr(mailer, "MAILER_RATE_PER_COMPANY", 1000)
+
+
+def test_messages_share_one_connection():
+    server = StandInSMTP()
+    results = _send(server, 5)
+    
+    assert all(result.success and result.attempts == 1 for result in results)
+    assert server.connections == 1
+    assert sorted(recipient for recipient, _ in server.messages) == [f"u{i}@x.cl" for i in range(5)]
+
+
+def test_reconnects_after_server_drops_connection():
+    server = StandInSMTP(drop_every=2)
+    results = _send(server, 5)
+    
+    assert all(result.success for result in results)
+    assert len(server.messages) == 5
+    assert server.connections == 3
+    assert [connection for _, connection in server.messages] == [1, 1, 2, 2, 3]
@@ -0,0 +1,130 @@
+"""
+Bandeja de salida: reserva de lotes, liberación de reservas vencidas y reintentos
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import (
+    Company, Area, User, QuestionnaireAssignment, AccessToken, TokenStatus,
+    EmailOutbox, OutboxStatus
+)
+from app.services import outbox
+from app.utils.mailer import MailResult
+
+N_USERS = 6
+
+
+@pytest.fixture
+def outbox_db(db, session_factory, monkeypatch):
+    """Tokens enviados con un correo pendiente cada uno; la bandeja usa la base de prueba"""
+    monkeypatch.setattr(outbox, "SessionLocal", session_factory)
+    
+    company = Company(name="Acme")
+    db.add(company)
+    db.flush()
+    area = Area(company_id=company.id, name="TI")
+    questionnaire = QuestionnaireAssignment(company_id=company.id, name="Campaña", send_reminders=False)
+    db.add_all([area, questionnaire])
+    db.flush()
+    users = [User(area_id=area.id, email=f"u{i}@x.cl", full_name=f"Usuario {i}") for i in range(N_USERS)]
+    db.add_all(users)
+    db.flush()
+    tokens = [
+        AccessToken(user_id=user.id, questionnaire_id=questionnaire.id, token=f"tok{user.id}", status=TokenStatus.SENT)
+        for user in users
+    ]
+    db.add_all(tokens)
+    db.flush()
+    outbox.enqueue_emails(db, [
+        {"company_id": company.id, "access_token_id": token.id, "to_email": f"u{i}@x.cl"}
+        for i, token in enumerate(tokens)
+    ])
+    db.commit()
+    return db
+
+
+def _claimed_ids(groups):
+    return [key[0] for _, _, messages in groups for key, _ in messages]
+
+
+def test_claim_skips_rows_taken_by_another_worker(outbox_db, monkeypatch):
+    """Otro worker reserva parte del lote entre la lectura y la reserva"""
+    due_rows = outbox._due_rows
+    other_groups = []
+    raced = []
+    
+    def racing_due_rows(db, batch_size):
+        rows = due_rows(db, batch_size)
+        if not raced:
+            raced.append(True)
+            other_groups.append(outbox._claim_batch(2)[0])
+        return rows
+    
+    monkeypatch.setattr(outbox, "_due_rows", racing_due_rows)
+    groups, failed = outbox._claim_batch(4)
+    
+    other = _claimed_ids(other_groups[0])
+    mine = _claimed_ids(groups)
+    assert not failed
+    assert len(other) == 2 and len(mine) == 4
+    assert not set(other) & set(mine)
+    
+    outbox_db.expire_all()
+    assert outbox_db.query(EmailOutbox).filter(EmailOutbox.status == OutboxStatus.SENDING).count() == 6
+    assert outbox._claim_batch(10) == ([], [])
+
+
+def test_release_returns_only_stale_claims(outbox_db):
+    now = datetime.utcnow()
+    rows = outbox_db.query(EmailOutbox).order_by(EmailOutbox.id).all()
+    rows[0].status, rows[0].claimed_at = OutboxStatus.SENDING, now - timedelta(hours=1)
+    rows[1].status, rows[1].claimed_at = OutboxStatus.SENDING, now
+    rows[2].status, rows[2].claimed_at = OutboxStatus.SENDING, None  # Reservado antes de existir claimed_at
+    outbox_db.commit()
+    
+    outbox._release_stale(timeout=600)
+    
+    outbox_db.expire_all()
+    assert [row.status for row in rows[:3]] == [OutboxStatus.PENDING, OutboxStatus.SENDING, OutboxStatus.PENDING]
+
+
+def _result(row, success=False, permanent=False):
+    result = MailResult((row.id, row.access_token_id, row.kind), row.to_email)
+    result.attempts = 1
+    result.success = success
+    result.permanent = permanent
+    result.error = None if success else "421 intente más tarde"
+    return result
+
+
+def test_failures_back_off_until_max_attempts(outbox_db, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    row = outbox_db.query(EmailOutbox).order_by(EmailOutbox.id).first()
+    
+    delays = []
+    for _ in range(2):
+        before = datetime.utcnow()
+        outbox._record_results([_result(row)])
+        outbox_db.expire_all()
+        assert row.status == OutboxStatus.PENDING
+        delays.append((row.next_attempt_at - before).total_seconds())
+    
+    assert delays[0] == pytest.approx(outbox.OUTBOX_RETRY_DELAY, abs=5)
+    assert delays[1] == pytest.approx(outbox.OUTBOX_RETRY_DELAY * 2, abs=5)
+    
+    outbox._record_results([_result(row)])
+    outbox_db.expire_all()
+    assert row.status == OutboxStatus.FAILED
+    assert row.attempts == 3
+
+
+def test_permanent_failure_and_success_are_final(outbox_db):
+    failed_row, sent_row = outbox_db.query(EmailOutbox).order_by(EmailOutbox.id).limit(2).all()
+    
+    outbox._record_results([_result(failed_row, permanent=True), _result(sent_row, success=True)])
+    
+    outbox_db.expire_all()
+    assert failed_row.status == OutboxStatus.FAILED
+    assert sent_row.status == OutboxStatus.SENT
+    assert sent_row.sent_at is not None